@@ -3,13 +3,13 @@ from tkinter import ttk, messagebox, filedialog
 from datetime import datetime
 from tkcalendar import DateEntry
 import threading
-import csv
+import time
+import os
 import json
-from database import DatabaseManager
+from database import DatabaseManager, ExportCancelled, PAGE_OLDER, PAGE_NEWER, decode_page_cursor
 from styled_button import StyledButton
 
-# สมมติว่าไฟล์นี้มีอยู่จริงสำหรับการรันโค้ด
-# from modbus_alarm_service import ModbusAlarmMonitor 
+# ใช้ create_monitor จาก modbus_alarm_service (เลือก engine ตาม modbus.engine ใน app_config.json)
 # หากไม่มีไฟล์ modbus_alarm_service ให้ใช้ ModbusAlarmMonitor_Dummy แทน
 class ModbusAlarmMonitor_Dummy:
     def __init__(self):
@@ -25,7 +25,11 @@ class ModbusAlarmMonitor_Dummy:
             self.active_alarms = (self.active_alarms + 1) % 5
             return {'modbus_connected': True, 'active_alarms': self.active_alarms}
         return {'modbus_connected': False, 'active_alarms': 0}
-ModbusAlarmMonitor = ModbusAlarmMonitor_Dummy
+
+try:
+    from modbus_alarm_service import create_monitor as ModbusAlarmMonitor
+except ImportError:
+    ModbusAlarmMonitor = ModbusAlarmMonitor_Dummy
 
 class AlarmHistoryApp:
     def __init__(self, root):
@@ -52,6 +56,30 @@ class AlarmHistoryApp:
         self.modbus_monitor = None
         self.monitor_status_label = None
         
+        # History paging (keyset cursors from DatabaseManager.get_alarm_page)
+        self.page_size = 500
+        self.page_number = 1
+        self.page_cursor = None  # Cursor the current page was loaded from
+        self.page_direction = PAGE_OLDER
+        self.older_cursor = None
+        self.newer_cursor = None
+        self.page_filters = None  # Filters the current page was loaded with
+        self.last_seen_id = None  # Highest id seen by the newest page
+        self.id_gaps = []  # Ids below last_seen_id not committed yet (late commits)
+        self.record_count = None  # get_record_count() result for page_filters
+        
+        # Page queries run in a background thread; a newer load supersedes them
+        self.query_generation = 0  # Incremented by every load_page()
+        self.query_thread = None  # Thread running the newest page query
+        self.page_loading = False  # Query running or rows still being inserted
+        self.row_chunk_size = 100  # Rows inserted into the table per Tk callback
+        self.search_delay = 400  # ms after the last keystroke before searching
+        self.search_after_id = None
+        
+        # New rows pushed by the database (LISTEN/NOTIFY)
+        self.new_rows_pending = threading.Event()
+        self.last_refresh = time.monotonic()
+        
         # Load configuration from app_config.json
         try:
             with open('app_config.json', 'r') as f:
@@ -94,6 +122,11 @@ class AlarmHistoryApp:
         # Start status update timer
         self.update_monitor_status()
         
+        # Wake up on new alarm_history rows instead of polling
+        if self.db_manager:
+            self.db_manager.start_listener(self.on_alarm_notify)
+        self.check_notifications()
+        
     def setup_styles(self):
         """Configure ttk styles for Dark Mode"""
         style = ttk.Style()
@@ -288,7 +321,8 @@ class AlarmHistoryApp:
             filter_frame, 
             textvariable=self.description_var,
             state='readonly',
-            width=30
+            width=30,
+            postcommand=self.load_descriptions  # Cached; picks up new descriptions
         )
         self.description_combo.set('All')
         self.description_combo.grid(row=3, column=0, columnspan=2, padx=5, pady=(0, 5), sticky='ew')
@@ -320,6 +354,7 @@ class AlarmHistoryApp:
         )
         search_entry.grid(row=3, column=4, padx=5, pady=(0, 5), sticky='ew')
         search_entry.bind('<Return>', lambda e: self.search_data())
+        self.search_var.trace_add('write', self.on_search_changed)
         
         # 🔎 Search Button
         search_btn = StyledButton(
@@ -401,11 +436,38 @@ class AlarmHistoryApp:
         )
         self.record_label.pack(side='left')
         
+        # ◀ ▶ Page navigation
+        newer_btn = StyledButton(
+            bottom_frame,
+            text="◀ Newer",
+            command=self.show_newer_page,
+            bg_color=self.secondary_bg,
+            fg_color='white',
+            font=('Arial', 10, 'bold'),
+            padx=12,
+            pady=6,
+            activebackground=self.disabled_color
+        )
+        newer_btn.pack(side='left', padx=(20, 4))
+        
+        older_btn = StyledButton(
+            bottom_frame,
+            text="Older ▶",
+            command=self.show_older_page,
+            bg_color=self.secondary_bg,
+            fg_color='white',
+            font=('Arial', 10, 'bold'),
+            padx=12,
+            pady=6,
+            activebackground=self.disabled_color
+        )
+        older_btn.pack(side='left', padx=4)
+        
         # Auto-refresh checkbox
         self.auto_refresh_var = tk.BooleanVar(value=True)
         auto_refresh_cb = tk.Checkbutton(
             bottom_frame,
-            text="Auto-refresh (5s)",
+            text="Auto-refresh",
             variable=self.auto_refresh_var,
             bg=self.primary_bg,
             fg=self.text_color,
@@ -455,7 +517,11 @@ class AlarmHistoryApp:
     def toggle_modbus_monitor(self):
         """Start or stop Modbus monitoring"""
         if self.modbus_monitor is None:
-            self.modbus_monitor = ModbusAlarmMonitor()
+            try:
+                self.modbus_monitor = ModbusAlarmMonitor()
+            except Exception as e:
+                messagebox.showerror("Error", f"Failed to create monitor:\n{str(e)}")
+                return
             
         if not self.modbus_monitor.running:
             try:
@@ -556,11 +622,37 @@ class AlarmHistoryApp:
                  bg=self.success_color, fg='white', padx=30, pady=10, font=('Arial', 12, 'bold'), relief='flat', cursor='hand2', activebackground='#20c232', activeforeground='white', highlightthickness=0, bd=0, overrelief='flat').pack(pady=20)
     
     def auto_refresh_data(self):
-        """Auto-refresh data every 5 seconds"""
-        if self.auto_refresh_var.get():
-            self.load_data()
+        """Auto-refresh data every 5 seconds
+        
+        Only the newest page changes with new events, and it is refreshed
+        incrementally; older pages are left as they are.
+        """
+        if self.auto_refresh_var.get() and self.newer_cursor is None and not self.page_loading:
+            # While notifications arrive, polling is only a slow safety net
+            listening = self.db_manager is not None and self.db_manager.listening
+            if not listening or time.monotonic() - self.last_refresh >= 60:
+                try:
+                    self.refresh_new_rows()
+                except Exception as e:
+                    print(f"Auto-refresh error: {str(e)}")
         self.root.after(5000, self.auto_refresh_data)
     
+    def on_alarm_notify(self, row_id):
+        """Called from the database listener thread when new rows arrive"""
+        self.new_rows_pending.set()
+    
+    def check_notifications(self):
+        """Refresh the newest page when the listener reported new rows"""
+        # Rows reported during a page load are picked up once it finished
+        if self.new_rows_pending.is_set() and not self.page_loading:
+            self.new_rows_pending.clear()
+            if self.auto_refresh_var.get() and self.newer_cursor is None:
+                try:
+                    self.refresh_new_rows()
+                except Exception as e:
+                    print(f"Auto-refresh error: {str(e)}")
+        self.root.after(100, self.check_notifications)
+    
     def load_descriptions(self):
         """Load unique descriptions for filter"""
         if not self.db_manager:
@@ -569,105 +661,418 @@ class AlarmHistoryApp:
         self.description_combo['values'] = descriptions
     
     def load_data(self):
-        """Load data from database (calls search to apply filters)"""
-        self.search_data()
+        """Reload the current page from database"""
+        self.load_page()
+    
+    def on_search_changed(self, *args):
+        """Search once typing in the search box pauses for search_delay ms"""
+        if self.search_after_id is not None:
+            self.root.after_cancel(self.search_after_id)
+        self.search_after_id = self.root.after(self.search_delay, self.search_data)
     
     def search_data(self):
-        """Search data with filters"""
-        if not self.db_manager:
-            messagebox.showerror("Error", "Database manager not initialized")
-            return
+        """Search data with filters, starting at the newest page"""
+        if self.search_after_id is not None:
+            self.root.after_cancel(self.search_after_id)
+            self.search_after_id = None
+        self.page_number = 1
+        self.page_cursor = None
+        self.page_direction = PAGE_OLDER
+        self.load_page()
+    
+    def show_older_page(self):
+        """Show the next page of older records"""
+        if self.older_cursor and not self.page_loading:
+            self.page_number += 1
+            self.page_cursor = self.older_cursor
+            self.page_direction = PAGE_OLDER
+            self.load_page()
+    
+    def show_newer_page(self):
+        """Show the previous page of newer records"""
+        if self.newer_cursor and not self.page_loading:
+            self.page_number = max(1, self.page_number - 1)
+            self.page_cursor = self.newer_cursor
+            self.page_direction = PAGE_NEWER
+            self.load_page()
+    
+    def get_filters(self):
+        """Build filters dictionary from the filter widgets
+        
+        Returns:
+            dict: Filters for DatabaseManager, or None if the input is invalid
+        """
+        filters = {}
         
+        # Date range filter
         try:
-            for item in self.tree.get_children():
-                self.tree.delete(item)
-            
-            # Build filters dictionary
-            filters = {}
-            
-            # Date range filter
+            from_datetime = datetime.strptime(
+                f"{self.from_date.get_date().strftime('%Y-%m-%d')} {self.from_time.get()}",
+                '%Y-%m-%d %H:%M:%S'
+            )
+            to_datetime = datetime.strptime(
+                f"{self.to_date.get_date().strftime('%Y-%m-%d')} {self.to_time.get()}",
+                '%Y-%m-%d %H:%M:%S'
+            )
+            filters['start_date'] = from_datetime
+            filters['end_date'] = to_datetime
+        except ValueError:
+            messagebox.showwarning("Warning", "Invalid time format (must be HH:MM:SS)")
+            return None
+        except Exception as e:
+            messagebox.showerror("Error", f"Date parsing error: {str(e)}")
+            return None
+        
+        if self.type_var.get() != 'All':
+            filters['alarm_type'] = self.type_var.get()
+        
+        if self.description_var.get() != 'All':
+            filters['description'] = self.description_var.get()
+        
+        if self.status_var.get() != 'All':
+            filters['status'] = self.status_var.get()
+        
+        if self.search_var.get():
+            filters['search_text'] = self.search_var.get()
+        
+        return filters
+    
+    def start_query(self, work, done, failed):
+        """Run database work in a background thread, superseding the running one
+        
+        The statement of the superseded thread is cancelled and its result
+        dropped. page_loading is set until done() or failed() clears it.
+        
+        Args:
+            work: Function called in the thread with the query generation;
+                its result is passed to done
+            done: Function called on the Tk thread with the generation and
+                the result
+            failed: Function called on the Tk thread with the exception
+        """
+        self.query_generation += 1
+        generation = self.query_generation
+        if self.query_thread is not None:
+            self.db_manager.cancel_queries(self.query_thread.ident)
+        self.page_loading = True
+        
+        # Shared with the query thread; only the Tk thread touches widgets
+        query_state = {'result': None, 'error': None, 'done': False}
+        
+        def run_query():
             try:
-                from_datetime = datetime.strptime(
-                    f"{self.from_date.get_date().strftime('%Y-%m-%d')} {self.from_time.get()}",
-                    '%Y-%m-%d %H:%M:%S'
-                )
-                to_datetime = datetime.strptime(
-                    f"{self.to_date.get_date().strftime('%Y-%m-%d')} {self.to_time.get()}",
-                    '%Y-%m-%d %H:%M:%S'
-                )
-                filters['start_date'] = from_datetime
-                filters['end_date'] = to_datetime
-            except ValueError:
-                messagebox.showwarning("Warning", "Invalid time format (must be HH:MM:SS)")
-                return
+                query_state['result'] = work(generation)
             except Exception as e:
-                messagebox.showerror("Error", f"Date parsing error: {str(e)}")
+                query_state['error'] = e
+            finally:
+                query_state['done'] = True
+        
+        def poll_query():
+            if generation != self.query_generation:
+                return  # Superseded by a newer query
+            if not query_state['done']:
+                self.root.after(50, poll_query)
                 return
             
-            if self.type_var.get() != 'All':
-                filters['alarm_type'] = self.type_var.get()
-            
-            if self.description_var.get() != 'All':
-                filters['description'] = self.description_var.get()
-            
-            if self.status_var.get() != 'All':
-                filters['status'] = self.status_var.get()
-            
-            if self.search_var.get():
-                filters['search_text'] = self.search_var.get()
-            
-            # Debug: Print filters
-            # print(f"Search filters: {filters}")
-            
-            rows = self.db_manager.get_alarm_history(filters=filters)
-            print(f"Found {len(rows)} records")
-            
-            for idx, row in enumerate(rows, start=1):
-                log_no, date_time, alarm_type, description, status, machine = row
-                date_time_str = date_time.strftime('%d/%m/%Y %H:%M:%S')
-                
-                tag = ''
-                if alarm_type and alarm_type.lower() == 'alarm':
-                    tag = 'alarm'
-                elif alarm_type and alarm_type.lower() == 'event':
-                    tag = 'event'
-                
-                if status and status.lower() == 'fault':
-                    tag = 'fault'
-                elif status and status.lower() == 'normal':
-                    tag = 'normal'
-                
-                self.tree.insert('', 'end', values=(
-                    idx, log_no, date_time_str, alarm_type, description, status, machine
-                ), tags=(tag,))
-            
-            self.record_label.config(text=f"Total Records: {len(rows)}")
+            self.query_thread = None
+            if query_state['error'] is not None:
+                self.page_loading = False
+                failed(query_state['error'])
+            else:
+                done(generation, query_state['result'])
+        
+        self.query_thread = threading.Thread(target=run_query, daemon=True)
+        self.query_thread.start()
+        self.root.after(50, poll_query)
+    
+    def load_page(self):
+        """Load the current page of records with filters
+        
+        The queries run in a background thread (see start_query) so the
+        window stays responsive, and the rows are added to the table in
+        chunks from the Tk thread.
+        """
+        if not self.db_manager:
+            messagebox.showerror("Error", "Database manager not initialized")
+            return
+        
+        filters = self.get_filters()
+        if filters is None:
+            return
+        
+        cursor = self.page_cursor
+        direction = self.page_direction
+        count_needed = cursor is None or filters != self.page_filters
+        
+        def work(generation):
+            page = self.db_manager.get_alarm_page(
+                filters=filters,
+                page_size=self.page_size,
+                cursor=cursor,
+                direction=direction
+            )
+            count = None
+            if count_needed and generation == self.query_generation:
+                count = self.db_manager.get_record_count(filters)
+            return page, count
+        
+        def done(generation, result):
+            page, count = result
+            if count_needed:
+                self.record_count = count
+            self.page_filters = filters
+            self.last_seen_id = page['last_id']
+            self.id_gaps = page['id_gaps']
+            self.older_cursor = page['older_cursor']
+            self.newer_cursor = page['newer_cursor']
+            if self.newer_cursor is None:
+                self.page_number = 1
+            print(f"Found {len(page['rows'])} records (page {self.page_number})")
             
-        except Exception as e:
-            print(f"Search error: {str(e)}")
-            messagebox.showerror("Error", f"Error searching data:\n{str(e)}")
+            self.tree.delete(*self.tree.get_children())
+            first_item = (self.page_number - 1) * self.page_size + 1
+            rows = list(enumerate(zip(page['rows'], page['cursors']), start=first_item))
+            self.insert_rows(generation, rows, 0)
+        
+        def failed(error):
+            self.update_record_label()
+            print(f"Search error: {str(error)}")
+            messagebox.showerror("Error", f"Error searching data:\n{str(error)}")
+        
+        self.start_query(work, done, failed)
+        self.record_label.config(text=f"Page {self.page_number}: Loading...")
     
-    def export_csv(self):
-        """Export data to CSV"""
-        try:
-            filename = filedialog.asksaveasfilename(
-                defaultextension='.csv',
-                filetypes=[("CSV files", "*.csv"), ("All files", "*.*")],
-                title="Save Alarm History Log"
+    def insert_rows(self, generation, rows, start):
+        """Insert a loaded page into the table, row_chunk_size rows per callback
+        
+        Args:
+            generation: query_generation of the load; stops when superseded
+            rows: (number, (row, cursor)) pairs of the page
+            start: Index in rows of the first row of this chunk
+        """
+        if generation != self.query_generation:
+            return
+        
+        end = start + self.row_chunk_size
+        for number, (row, cursor) in rows[start:end]:
+            self.insert_row('end', number, row, cursor)
+        
+        if end < len(rows):
+            self.root.after(1, self.insert_rows, generation, rows, end)
+        else:
+            self.page_loading = False
+            self.update_record_label()
+    
+    def insert_row(self, index, number, row, cursor):
+        """Insert one record into the table (the row iid is its page cursor)"""
+        log_no, date_time, alarm_type, description, status, machine = row
+        date_time_str = date_time.strftime('%d/%m/%Y %H:%M:%S')
+        
+        tag = ''
+        if alarm_type and alarm_type.lower() == 'alarm':
+            tag = 'alarm'
+        elif alarm_type and alarm_type.lower() == 'event':
+            tag = 'event'
+        
+        if status and status.lower() == 'fault':
+            tag = 'fault'
+        elif status and status.lower() == 'normal':
+            tag = 'normal'
+        
+        self.tree.insert('', index, iid=cursor, values=(
+            number, log_no, date_time_str, alarm_type, description, status, machine
+        ), tags=(tag,))
+    
+    def update_record_label(self):
+        """Show the page number and record range"""
+        count = len(self.tree.get_children())
+        first_item = (self.page_number - 1) * self.page_size + 1
+        total = ""
+        if count and self.record_count:
+            approx = "" if self.record_count['exact'] else "~"
+            total = f" of {approx}{self.record_count['count']:,}"
+        self.record_label.config(
+            text=f"Page {self.page_number}: Records {first_item}-{first_item + count - 1}{total}"
+            if count else f"Page {self.page_number}: No records"
+        )
+    
+    def refresh_new_rows(self):
+        """Add records inserted since the last refresh to the newest page
+        
+        Only rows with an id above the last one seen (or committed late just
+        below it) are fetched, in a background thread like load_page(). They
+        are inserted in place (normally at the top), the table is trimmed
+        back to page_size rows, and nothing is redrawn when there is nothing
+        new.
+        """
+        if not self.db_manager or self.last_seen_id is None or self.page_loading:
+            return
+        
+        self.last_refresh = time.monotonic()
+        last_seen_id = self.last_seen_id
+        id_gaps = self.id_gaps
+        filters = self.page_filters
+        
+        def work(generation):
+            return self.db_manager.get_alarms_since(
+                last_seen_id, filters, limit=self.page_size, id_gaps=id_gaps
             )
+        
+        def failed(error):
+            print(f"Auto-refresh error: {str(error)}")
+        
+        self.start_query(work, self.show_new_rows, failed)
+    
+    def show_new_rows(self, generation, result):
+        """Insert the result of a refresh_new_rows() query into the newest page"""
+        self.page_loading = False
+        if result is None:
+            return
+        if not result['complete']:
+            # More new rows than fit on a page: reload it
+            self.load_page()
+            return
+        
+        self.last_seen_id = result['last_id']
+        self.id_gaps = result['id_gaps']
+        added = 0
+        for row, cursor in zip(result['rows'], result['cursors']):
+            if self.tree.exists(cursor):
+                continue  # Already read with the page
+            if self.record_count:
+                self.record_count['count'] += 1
+            index = self.find_row_index(cursor)
+            if index is None:
+                continue
+            self.insert_row(index, 0, row, cursor)
+            added += 1
+        
+        if not added:
+            return
+        
+        # Trim the tail back to one page
+        children = self.tree.get_children()
+        if len(children) > self.page_size:
+            self.tree.delete(*children[self.page_size:])
+            children = children[:self.page_size]
+            self.older_cursor = children[-1]
+        
+        for number, item in enumerate(children, start=1):
+            self.tree.set(item, 'Item', number)
+        self.update_record_label()
+        print(f"Added {added} new records")
+    
+    def find_row_index(self, cursor):
+        """Position of a new row in the newest page, or None if it belongs to an older page"""
+        key = decode_page_cursor(cursor)
+        for index, item in enumerate(self.tree.get_children()):
+            if key > decode_page_cursor(item):
+                return index
+        # Older than every row on the page: only shown if the page is not full
+        return 'end' if self.older_cursor is None else None
+    
+    def export_csv(self):
+        """Export all records matching the filters to CSV
+        
+        The export streams from the database in a background thread, so it
+        covers the whole result (not just the page on screen) and the window
+        stays responsive. A progress window shows the records written and can
+        cancel the export.
+        """
+        if not self.db_manager:
+            messagebox.showerror("Error", "Database manager not initialized")
+            return
+        
+        filters = self.get_filters()
+        if filters is None:
+            return
+        
+        filename = filedialog.asksaveasfilename(
+            defaultextension='.csv',
+            filetypes=[("CSV files", "*.csv"), ("All files", "*.*")],
+            title="Save Alarm History Log"
+        )
+        if not filename:
+            return
+        
+        # Progress window
+        progress_window = tk.Toplevel(self.root)
+        progress_window.title("Export CSV")
+        progress_window.geometry("360x150")
+        progress_window.configure(bg=self.primary_bg)
+        progress_window.resizable(False, False)
+        progress_window.transient(self.root)
+        
+        progress_label = tk.Label(progress_window, text="Exporting... 0 records",
+                                  bg=self.primary_bg, fg=self.text_color, font=('Arial', 11))
+        progress_label.pack(pady=(15, 8))
+        
+        progress_bar = ttk.Progressbar(progress_window, mode='indeterminate', length=300)
+        progress_bar.pack(pady=5)
+        progress_bar.start(15)
+        
+        # Shared with the export thread; only the Tk thread touches widgets
+        export_state = {'records': 0, 'done': False, 'error': None}
+        cancel_event = threading.Event()
+        export_thread = None
+        
+        def cancel_export():
+            cancel_event.set()
+            # Stop the COPY on the server even while it sends no rows
+            if export_thread is not None:
+                self.db_manager.cancel_queries(export_thread.ident)
+        
+        cancel_btn = StyledButton(
+            progress_window,
+            text="✖ Cancel",
+            command=cancel_export,
+            bg_color=self.danger_color,
+            fg_color='white',
+            font=('Arial', 10, 'bold'),
+            padx=14,
+            pady=6,
+            activebackground='#cc0000'
+        )
+        cancel_btn.pack(pady=10)
+        progress_window.protocol("WM_DELETE_WINDOW", cancel_export)
+        
+        def run_export():
+            try:
+                with open(filename, 'wb') as file:
+                    export_state['records'] = self.db_manager.export_alarm_history(
+                        file,
+                        filters=filters,
+                        progress=lambda records: export_state.update(records=records),
+                        cancel_event=cancel_event
+                    )
+            except Exception as e:
+                export_state['error'] = e
+            finally:
+                export_state['done'] = True
+        
+        def poll_export():
+            if not export_state['done']:
+                progress_label.config(text=f"Exporting... {export_state['records']:,} records")
+                self.root.after(200, poll_export)
+                return
             
-            if filename:
-                with open(filename, 'w', newline='', encoding='utf-8') as file:
-                    writer = csv.writer(file)
-                    writer.writerow(['Item', 'Log no.', 'Date/Time', 'Type', 'Description', 'Status', 'Machine'])
-                    
-                    for item in self.tree.get_children():
-                        values = self.tree.item(item)['values']
-                        writer.writerow(values)
-                
-                messagebox.showinfo("Success", f"Data exported to:\n{filename}")
-        except Exception as e:
-            messagebox.showerror("Error", f"Error exporting data:\n{str(e)}")
+            progress_bar.stop()
+            progress_window.destroy()
+            error = export_state['error']
+            if isinstance(error, ExportCancelled):
+                try:
+                    os.remove(filename)
+                except OSError:
+                    pass
+                messagebox.showinfo("Export Cancelled", "CSV export was cancelled")
+            elif error is not None:
+                messagebox.showerror("Error", f"Error exporting data:\n{str(error)}")
+            else:
+                messagebox.showinfo("Success", f"{export_state['records']:,} records exported to:\n{filename}")
+        
+        export_thread = threading.Thread(target=run_export, daemon=True)
+        export_thread.start()
+        self.root.after(200, poll_export)
     
     def __del__(self):
         """Cleanup"""
@@ -0,0 +1,248 @@
+import asyncio
+import threading
+import time
+from datetime import datetime
+from pymodbus.client import AsyncModbusTcpClient
+from pymodbus.exceptions import ConnectionException, ModbusException, ModbusIOException
+from modbus_alarm_service import ModbusAlarmMonitor, logger
+from modbus_device import STATE_CONNECTED, STATE_CONNECTING, STATE_DISCONNECTED
+from scan_planner import FUNCTION_READ_COILS
+
+
+class AsyncModbusAlarmMonitor(ModbusAlarmMonitor):
+    """Alarm monitor running its scans on asyncio with AsyncModbusTcpClient
+
+    Every scan job (device and scan class) runs as its own task. The block
+    reads of a scan are spread over a small set of connections
+    (modbus.async_connections) that are read concurrently. pymodbus runs one
+    request at a time per connection, so each connection reads its windows
+    one after another and every read gets its own deadline (modbus.timeout)
+    once it has the connection. A slow window only delays the windows behind
+    it on the same connection, by at most one deadline.
+    """
+
+    def __init__(self, config_file='app_config.json'):
+        """Initialize async Modbus Alarm Monitor"""
+        super().__init__(config_file)
+        self.loop = None
+        self.request_deadline = self.config['modbus']['timeout']
+
+    def is_modbus_connected(self, device):
+        """Check if at least one Modbus connection of a device is open"""
+        return any(client.connected for client in device.clients)
+
+    async def connect_modbus_async(self, device):
+        """Open the async Modbus TCP connections of a device"""
+        modbus_config = self.config['modbus']
+        connections = max(1, int(modbus_config.get('async_connections', 2)))
+
+        self.close_clients(device)
+
+        logger.info(f"Connecting to Modbus device {device.name} (async, {connections} connections)")
+
+        clients = [
+            AsyncModbusTcpClient(
+                host=device.host,
+                port=device.port,
+                timeout=modbus_config['timeout'],
+                retries=modbus_config['retries'],
+                reconnect_delay=0  # Reconnects follow the device backoff instead
+            )
+            for _ in range(connections)
+        ]
+        results = await asyncio.gather(*(client.connect() for client in clients), return_exceptions=True)
+
+        for client, result in zip(clients, results):
+            if result is True:
+                device.clients.append(client)
+            else:
+                client.close()
+
+        if device.clients:
+            # The backoff is reset by the first good read (see scan_device_async)
+            device.connection_state = STATE_CONNECTED
+            logger.info(f"Modbus connected to {device.host}:{device.port} "
+                        f"({device.name}, {len(device.clients)}/{connections} connections)")
+            return True
+
+        device.connection_state = STATE_DISCONNECTED
+        delay = device.backoff.failure()
+        logger.error(f"Failed to connect to Modbus device {device.name} "
+                     f"(attempt {device.backoff.attempts}, retry in {delay:.1f}s)")
+        return False
+
+    def schedule_reconnect(self, device):
+        """Start a background reconnect task once the device backoff has expired"""
+        if device.connection_state == STATE_CONNECTING or not device.backoff.ready():
+            return
+        device.connection_state = STATE_CONNECTING
+        device.connect_task = asyncio.ensure_future(self.connect_modbus_async(device))
+
+    def mark_disconnected(self, device, reason):
+        """Drop the connections of a device after they were lost"""
+        logger.warning(f"Modbus device {device.name} disconnected: {reason}")
+        self.close_clients(device)
+        device.connection_state = STATE_DISCONNECTED
+        device.backoff.failure()
+
+    def close_clients(self, device):
+        """Close all async Modbus connections of a device"""
+        for client in device.clients:
+            client.close()
+        device.clients = []
+
+    async def read_window(self, device, client, window):
+        """Read one scan window within the per-request deadline
+
+        Returns:
+            tuple: (bits, acquisition time), or None on an error response
+
+        Raises:
+            asyncio.TimeoutError, ConnectionException, ModbusIOException: The
+                device did not answer or the connection is gone
+        """
+        try:
+            if window.function_code == FUNCTION_READ_COILS:
+                request = client.read_coils(window.start, count=window.count, device_id=device.unit_id)
+            else:
+                request = client.read_discrete_inputs(window.start, count=window.count, device_id=device.unit_id)
+
+            response = await asyncio.wait_for(request, timeout=self.request_deadline)
+            if response.isError():
+                logger.error(f"Error reading {window} ({device.name})")
+                return None
+            return response.bits[:window.count], datetime.now()
+
+        except (ConnectionException, ModbusIOException):
+            raise  # The connection is gone: scan_device_async() stops the scan
+        except ModbusException as e:
+            logger.error(f"Modbus exception reading {window} ({device.name}): {e}")
+        return None
+
+    async def read_lane(self, device, client, windows):
+        """Read windows one after another on one connection and process each"""
+        for window in windows:
+            result = await self.read_window(device, client, window)
+            if result is None or len(result[0]) < window.count:
+                continue
+
+            bits, acquired_at = result
+            device.backoff.success()
+            self.process_window(device, window, bits, acquired_at)
+
+    async def scan_device_async(self, device, windows):
+        """Scan block windows of one device, one lane of reads per connection"""
+        if device.connection_state != STATE_CONNECTED or not self.is_modbus_connected(device):
+            # Reconnect in its own task; the scan resumes once it succeeds
+            if device.connection_state == STATE_CONNECTED:
+                self.mark_disconnected(device, "connection lost")
+            self.schedule_reconnect(device)
+            return
+
+        clients = [client for client in device.clients if client.connected]
+
+        lanes = [windows[index::len(clients)] for index in range(len(clients))]
+        results = await asyncio.gather(*(
+            self.read_lane(device, client, lane)
+            for client, lane in zip(clients, lanes) if lane
+        ), return_exceptions=True)
+
+        # A lane stops at its first unanswered read; the device then backs
+        # off like a lost connection instead of timing out every cycle
+        for result in results:
+            if isinstance(result, asyncio.TimeoutError):
+                self.mark_disconnected(device, f"no response within {self.request_deadline}s")
+                break
+            if isinstance(result, (ConnectionException, ModbusIOException)):
+                self.mark_disconnected(device, result)
+                break
+            if isinstance(result, Exception):
+                logger.error(f"Error scanning {device.name}: {result}")
+
+    async def run_scan_job_async(self, job, deadline):
+        """Scan one job and record its cycle timing"""
+        started = time.monotonic()
+        try:
+            await self.scan_device_async(job.device, job.scan_class.windows)
+        finally:
+            job.stats.record(deadline, started, time.monotonic())
+
+    def submit_scan(self, job, deadline):
+        """Start a due scan job as a task
+
+        A job whose previous scan is still running (slow or dead outstation)
+        is skipped for this period so it never delays the other devices.
+        """
+        if job.is_pending():
+            logger.debug(f"{job} still in progress, skipping")
+            job.stats.skipped += 1
+            return
+        job.pending = asyncio.ensure_future(self.run_scan_job_async(job, deadline))
+
+    async def monitoring_loop_async(self):
+        """Main asyncio monitoring loop: start scan jobs as their deadlines come due"""
+        scheduler = self.build_scheduler()
+
+        logger.info("Monitoring started (async engine)")
+
+        try:
+            while self.running:
+                try:
+                    delay = scheduler.time_until_next()
+                    if delay > 0:
+                        # Wake up regularly so stop() is noticed promptly
+                        await asyncio.sleep(min(delay, 0.5))
+                        continue
+
+                    for job, deadline in scheduler.pop_due():
+                        self.submit_scan(job, deadline)
+
+                except Exception as e:
+                    logger.error(f"Error in monitoring loop: {e}")
+                    # Missed deadlines are skipped/compressed by the scheduler
+                    await asyncio.sleep(self.config['monitoring']['scan_interval'])
+        finally:
+            # Closing the connections fails the in-flight reads of each scan
+            for device in self.devices:
+                self.close_clients(device)
+
+            pending = [job.pending for job in self.scan_jobs if job.is_pending()]
+            pending += [device.connect_task for device in self.devices
+                        if device.connect_task is not None and not device.connect_task.done()]
+            if pending:
+                _, still_running = await asyncio.wait(pending, timeout=self.request_deadline)
+                for task in still_running:
+                    task.cancel()
+
+            # Reconnects that finished during shutdown
+            for device in self.devices:
+                self.close_clients(device)
+
+    def monitoring_loop(self):
+        """Run the asyncio monitoring loop in the monitor thread"""
+        self.loop = asyncio.new_event_loop()
+        try:
+            self.loop.run_until_complete(self.monitoring_loop_async())
+        finally:
+            self.loop.close()
+            self.loop = None
+
+    def start(self):
+        """Start alarm monitoring
+
+        Unlike the thread engine the first connection is made inside the
+        event loop, so start() never blocks on the Modbus timeout.
+        """
+        if self.running:
+            logger.warning("Monitor is already running")
+            return
+
+        self.event_writer.start()
+
+        self.running = True
+        self.stop_event.clear()
+        self.monitor_thread = threading.Thread(target=self.monitoring_loop, daemon=True)
+        self.monitor_thread.start()
+        self.start_maintenance()
+
+        logger.info("Alarm monitoring started (async engine)")
@@ -0,0 +1,101 @@
+"""
+Benchmark the free-text search with and without the pg_trgm index
+
+Builds a scratch table alarm_search_bench shaped like alarm_history_data
+(names as ids of the lookup tables), times the search query of the history
+view on it before and after creating the indexes used by init.sql, then
+drops the table.
+
+Usage: python benchmark_search.py [rows] [repeat]
+"""
+
+import json
+import sys
+import time
+from database import DatabaseManager
+
+ROWS = int(sys.argv[1]) if len(sys.argv) > 1 else 2000000
+REPEAT = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+PAGE_SIZE = 500
+
+# Rare log number, common word, phrase, status and a miss
+SEARCH_TERMS = ['8290123456', 'GPS', 'Sensor B fault', 'Restart', 'no such alarm']
+
+CREATE_BENCH_TABLE = """
+    CREATE UNLOGGED TABLE alarm_search_bench AS
+    SELECT g AS id,
+           (8290000000 + g)::text AS log_no,
+           TIMESTAMP '2024-01-01' + g * INTERVAL '15 seconds' AS date_time,
+           types[1 + mod(g, cardinality(types))] AS type_id,
+           descriptions[1 + mod(g, cardinality(descriptions))] AS description_id,
+           statuses[1 + mod(g, cardinality(statuses))] AS status_id,
+           1::smallint AS machine_id
+    FROM generate_series(1, %s) AS g,
+         (SELECT ARRAY(SELECT id FROM alarm_types ORDER BY id) AS types,
+                 ARRAY(SELECT id FROM alarm_descriptions ORDER BY id) AS descriptions,
+                 ARRAY(SELECT id FROM alarm_statuses ORDER BY id) AS statuses) AS lookups
+"""
+
+
+def run(db, statement, params=None):
+    """Execute a statement that returns nothing"""
+    def operation(cursor):
+        cursor.execute(statement, params)
+    db.execute(operation, retry=False)
+
+
+def time_search(db, term):
+    """Median seconds of the history view's search query for term"""
+    conditions, params = db.build_filter_clause({'search_text': term})
+    query = ("SELECT log_no, date_time, type_id, description_id, status_id, machine_id FROM alarm_search_bench"
+             " WHERE 1=1" + conditions + " ORDER BY date_time DESC, id DESC LIMIT %s")
+
+    timings = []
+    for _ in range(REPEAT):
+        started = time.perf_counter()
+        rows = db.fetchall(query, params + [PAGE_SIZE])
+        timings.append(time.perf_counter() - started)
+    timings.sort()
+    return timings[len(timings) // 2], len(rows)
+
+
+def time_all(db):
+    return {term: time_search(db, term) for term in SEARCH_TERMS}
+
+
+# Load config
+with open('app_config.json', 'r') as f:
+    config = json.load(f)
+
+# Connect to database
+db = DatabaseManager(config)
+
+try:
+    print(f"Creating alarm_search_bench with {ROWS:,} rows...")
+    run(db, "DROP TABLE IF EXISTS alarm_search_bench")
+    run(db, CREATE_BENCH_TABLE, (ROWS,))
+    run(db, "CREATE INDEX ON alarm_search_bench (date_time DESC, id DESC)")
+    run(db, "ANALYZE alarm_search_bench")
+
+    before = time_all(db)
+
+    print("Creating trigram and id indexes...")
+    started = time.perf_counter()
+    run(db, "CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    run(db, "CREATE INDEX ON alarm_search_bench USING gin (log_no gin_trgm_ops)")
+    run(db, "CREATE INDEX ON alarm_search_bench (description_id)")
+    run(db, "CREATE INDEX ON alarm_search_bench (status_id)")
+    run(db, "ANALYZE alarm_search_bench")
+    print(f"Indexes built in {time.perf_counter() - started:.1f}s")
+
+    after = time_all(db)
+
+    print(f"\nMedian of {REPEAT} runs, first {PAGE_SIZE} matches:")
+    print(f"  {'Search text':<20} {'Rows':>6} {'No index':>12} {'Indexed':>12} {'Speedup':>9}")
+    for term in SEARCH_TERMS:
+        (plain, rows), (indexed, _) = before[term], after[term]
+        print(f"  {term:<20} {rows:>6} {plain * 1000:>10.1f}ms {indexed * 1000:>10.1f}ms "
+              f"{plain / indexed if indexed else 0:>8.1f}x")
+finally:
+    run(db, "DROP TABLE IF EXISTS alarm_search_bench")
+    db.close()
@@ -1,44 +1,367 @@
+import json
 import logging
+import re
+import select
+import threading
+from collections import OrderedDict
 import psycopg2
+from psycopg2 import extensions, sql
 from datetime import datetime
 import time
+from db_pool import ConnectionPool
+from log_generator import LogNumberGenerator
+
+# Errors after which the connection itself may be gone
+CONNECTION_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError)
+
+# Errors caused by the rows themselves: writing them again fails again
+DATA_ERRORS = (psycopg2.DataError, psycopg2.IntegrityError)
+
+# Channel notified by the alarm_history insert trigger (payload: highest new id)
+NOTIFY_CHANNEL = 'alarm_history_insert'
+
+# Channel notified when alarm_filter_values gains new dropdown values
+FILTER_VALUES_CHANNEL = 'alarm_filter_values'
+
+# Directions of get_alarm_page() relative to its cursor
+PAGE_OLDER = 'older'
+PAGE_NEWER = 'newer'
+
+# Ids below the high-water mark that get_alarms_since() keeps watching: with
+# several writers a row can commit after a row with a higher id was seen
+LATE_COMMIT_WINDOW = 2000
+
+# Prepared statements kept per connection before the least recently used is deallocated
+PREPARED_STATEMENTS_MAX = 64
+
+# Insert of any number of alarm history rows (one array per column), so
+# single events and batches share one prepared statement
+INSERT_ALARMS = """
+    INSERT INTO alarm_history_data 
+    (log_no, date_time, type_id, description_id, status_id, machine_id)
+    SELECT * FROM unnest(%s::varchar[], %s::timestamp[], %s::smallint[],
+                         %s::smallint[], %s::smallint[], %s::smallint[])"""
+
+# Lookup table of each name column of the alarm history
+LOOKUP_TABLES = {
+    'type': 'alarm_types',
+    'description': 'alarm_descriptions',
+    'status': 'alarm_statuses',
+    'machine': 'alarm_machines'
+}
+
+
+# Columns and formats of the CSV export (same as the history table in the GUI)
+EXPORT_QUERY = """
+    SELECT row_number() OVER (ORDER BY date_time DESC, id DESC) AS "Item",
+           log_no AS "Log no.",
+           to_char(date_time, 'DD/MM/YYYY HH24:MI:SS') AS "Date/Time",
+           type AS "Type",
+           description AS "Description",
+           status AS "Status",
+           machine AS "Machine"
+    FROM alarm_history
+    WHERE 1=1"""
+
+
+class PreparingConnection(extensions.connection):
+    """psycopg2 connection that prepares its statements once and runs them by name"""
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.statements = OrderedDict()  # query text -> (statement name, parameter count)
+        self.statement_counter = 0
+    
+    def execute_prepared(self, cursor, query, params=None):
+        """Execute query on cursor as a prepared statement
+        
+        The first call with a query text PREPAREs it on this connection;
+        later calls only send EXECUTE with the parameters, so PostgreSQL
+        parses and plans the statement once per connection. Each filter
+        combination of build_filter_clause() is a separate statement.
+        
+        Args:
+            cursor: Cursor of this connection
+            query: SQL with %s placeholders
+            params: Sequence of parameters
+        """
+        statement = self.statements.get(query)
+        if statement is None:
+            if len(self.statements) >= PREPARED_STATEMENTS_MAX:
+                _, (oldest, _) = self.statements.popitem(last=False)
+                cursor.execute(f"DEALLOCATE {oldest}")
+            
+            count = 0
+            def number(match):
+                nonlocal count
+                if match.group(0) == '%%':
+                    return '%'
+                count += 1
+                return f"${count}"
+            
+            numbered = re.sub(r'%%|%s', number, query)
+            self.statement_counter += 1
+            statement = (f"alarm_stmt_{self.statement_counter}", count)
+            cursor.execute(f"PREPARE {statement[0]} AS {numbered}")
+            self.statements[query] = statement
+        else:
+            self.statements.move_to_end(query)
+        
+        name, count = statement
+        if count:
+            cursor.execute(f"EXECUTE {name} ({', '.join(['%s'] * count)})", params)
+        else:
+            cursor.execute(f"EXECUTE {name}")
+
+
+class ExportCancelled(Exception):
+    """Raised when a CSV export is cancelled"""
+
+
+class CopyProgressWriter:
+    """Binary file wrapper that counts COPY output rows and checks for cancel
+    
+    Once cancel_event is set the COPY is cancelled on the server through
+    connection, so the backend stops sending rows, and the rest of the
+    output is dropped.
+    """
+    
+    def __init__(self, file, progress=None, cancel_event=None, report_every=1000):
+        """Initialize writer
+        
+        Args:
+            file: Binary file the CSV is written to
+            progress: Function called with the number of lines written so far
+            cancel_event: threading.Event that aborts the export when set
+            report_every: Lines between progress calls
+        """
+        self.file = file
+        self.progress = progress
+        self.cancel_event = cancel_event
+        self.report_every = report_every
+        self.connection = None  # Connection running the COPY
+        self.cancelled = False
+        self.lines = 0
+        self.reported = 0
+    
+    def write(self, data):
+        if self.cancelled:
+            return
+        if self.cancel_event is not None and self.cancel_event.is_set():
+            self.cancelled = True
+            if self.connection is not None:
+                self.connection.cancel()
+            return
+        self.file.write(data)
+        self.lines += data.count(b'\n')
+        if self.progress and self.lines - self.reported >= self.report_every:
+            self.reported = self.lines
+            self.progress(self.lines)
+
+
+def escape_like(text):
+    """Escape the LIKE wildcards in text so it matches literally"""
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def encode_page_cursor(date_time, row_id):
+    """Encode the (date_time, id) key of a row as a page cursor token"""
+    return f"{date_time.isoformat()}|{row_id}"
+
+
+def decode_page_cursor(token):
+    """Decode a page cursor token into its (date_time, id) key"""
+    date_time, row_id = token.rsplit('|', 1)
+    return datetime.fromisoformat(date_time), int(row_id)
+
 
 class DatabaseManager:
-    """Manages all database operations for the alarm system"""
+    """Manages all database operations for the alarm system
     
-    def __init__(self, config):
-        """Initialize database manager with configuration"""
+    Every operation checks a connection out of a bounded pool and returns it
+    when done, so the GUI, its refresh timer and the alarm monitor never share
+    a connection or wait behind each other's transactions.
+    """
+    
+    def __init__(self, config, required=True):
+        """Initialize database manager with configuration
+        
+        Args:
+            config: Application configuration dictionary
+            required: Raise if the database is unreachable. When False the
+                manager starts disconnected and reconnects on demand.
+        """
         self.config = config
-        self.connection = None
-        self.log_counter = 0
-        self.last_date = None
-        self.connect()
+        self.pool = None
+        self.available = False
+        self.pool_lock = threading.Lock()
+        self.log_numbers = LogNumberGenerator()
+        self.lookup_ids = {column: {} for column in LOOKUP_TABLES}  # column -> name -> id
+        self.listener_thread = None
+        self.listener_stop = threading.Event()
+        self.listening = False
+        self.running_queries = {}  # thread id -> connection running an operation
+        self.running_lock = threading.Lock()
+        self.filter_values = {}  # kind -> (expiry on the monotonic clock, dropdown values)
+        self.filter_values_ttl = config['database'].get('filter_cache_ttl', 300)
+        try:
+            self.connect()
+        except Exception:
+            if required:
+                raise
     
     def connect(self):
-        """Connect to PostgreSQL database"""
+        """Create the connection pool and check that the database is reachable
+        
+        database.pool_size bounds the number of connections (default 4),
+        database.pool_timeout is the wait for a free one in seconds (default 10)
+        and database.health_check_interval the idle time after which a pooled
+        connection is pinged before reuse (default 30).
+        """
         try:
             db_config = self.config['database']
-            self.connection = psycopg2.connect(
-                host=db_config['host'],
-                port=db_config['port'],
-                database=db_config['database'],
-                user=db_config['user'],
-                password=db_config['password']
-            )
+            with self.pool_lock:
+                if self.pool is None:
+                    self.pool = ConnectionPool(
+                        self.connect_kwargs(),
+                        max_size=db_config.get('pool_size', 4),
+                        timeout=db_config.get('pool_timeout', 10),
+                        health_check_interval=db_config.get('health_check_interval', 30)
+                    )
+            
+            self.pool.put(self.pool.get())
+            self.available = True
             logging.info("Database connected successfully")
         except Exception as e:
+            self.available = False
             logging.error(f"Database connection failed: {e}")
             raise
     
+    def connect_kwargs(self):
+        """Connection parameters for psycopg2.connect()"""
+        db_config = self.config['database']
+        return {
+            'host': db_config['host'],
+            'port': db_config['port'],
+            'database': db_config['database'],
+            'user': db_config['user'],
+            'password': db_config['password'],
+            'connection_factory': PreparingConnection
+        }
+    
     def is_connected(self):
-        """Check if database is connected"""
-        return self.connection is not None and not self.connection.closed
+        """Check if the database was reachable on the last operation"""
+        return self.pool is not None and self.available
+    
+    def ensure_connected(self):
+        """Check the database is reachable, reconnecting if it was lost
+        
+        Returns:
+            bool: True if connected
+        """
+        if self.is_connected():
+            return True
+        try:
+            self.connect()
+            return True
+        except Exception:
+            return False
+    
+    def execute(self, operation, retry=True):
+        """Run an operation on a pooled connection and commit it
+        
+        Args:
+            operation: Function called with a cursor; its result is returned
+            retry: Run the operation once more on a fresh connection if the
+                connection was lost (only for operations safe to repeat)
+        
+        Returns:
+            Result of operation
+        """
+        if self.pool is None:
+            self.connect()
+        
+        attempts = 2 if retry else 1
+        for attempt in range(attempts):
+            try:
+                conn = self.pool.get()
+            except CONNECTION_ERRORS:
+                self.available = False
+                raise
+            thread_id = threading.get_ident()
+            try:
+                with self.running_lock:
+                    self.running_queries[thread_id] = conn
+                try:
+                    with conn.cursor() as cursor:
+                        result = operation(cursor)
+                finally:
+                    with self.running_lock:
+                        self.running_queries.pop(thread_id, None)
+                conn.commit()
+                self.pool.put(conn)
+                self.available = True
+                return result
+            except CONNECTION_ERRORS as e:
+                if not conn.closed:
+                    self.pool.put(conn)
+                    raise
+                # The server went away: the idle connections are dead too
+                self.pool.put(conn, discard=True)
+                self.pool.clear()
+                self.available = False
+                if attempt + 1 == attempts:
+                    raise
+                logging.warning(f"Database connection lost, retrying: {e}")
+            except Exception:
+                self.pool.put(conn)
+                raise
+    
+    def run_query(self, cursor, query, params=None, prepare=False):
+        """Execute query on cursor, as a prepared statement if prepare is set"""
+        if prepare:
+            cursor.connection.execute_prepared(cursor, query, params)
+        else:
+            cursor.execute(query, params)
+    
+    def cancel_queries(self, thread_id):
+        """Cancel the statement an operation of another thread is running
+        
+        The cancelled operation fails with psycopg2.errors.QueryCanceled.
+        Nothing happens when the thread is not running an operation.
+        
+        Args:
+            thread_id: threading.get_ident() of the thread
+        """
+        with self.running_lock:
+            conn = self.running_queries.get(thread_id)
+            if conn is not None:
+                try:
+                    conn.cancel()
+                except Exception as e:
+                    logging.warning(f"Could not cancel query: {e}")
+    
+    def fetchall(self, query, params=None, prepare=False):
+        """Run a read-only query and return all rows
+        
+        Hot queries pass prepare=True to run as a prepared statement.
+        """
+        def operation(cursor):
+            self.run_query(cursor, query, params, prepare)
+            return cursor.fetchall()
+        return self.execute(operation)
+    
+    def fetchone(self, query, params=None, prepare=False):
+        """Run a read-only query and return the first row"""
+        def operation(cursor):
+            self.run_query(cursor, query, params, prepare)
+            return cursor.fetchone()
+        return self.execute(operation)
     
     def load_alarm_mapping(self):
         """Load alarm mapping configuration from database"""
         try:
-            cursor = self.connection.cursor()
-            cursor.execute("""
+            rows = self.fetchall("""
                 SELECT item, description, signal_type, close_status, 
                        alarm_status, priority, address, bit_no, 
                        modbus_function, enabled
@@ -48,7 +371,7 @@ class DatabaseManager:
             """)
             
             mappings = []
-            for row in cursor.fetchall():
+            for row in rows:
                 mapping = {
                     'item': row[0],
                     'description': row[1],
@@ -63,7 +386,6 @@ class DatabaseManager:
                 }
                 mappings.append(mapping)
             
-            cursor.close()
             logging.info(f"Loaded {len(mappings)} alarm mappings from database")
             return mappings
             
@@ -71,58 +393,153 @@ class DatabaseManager:
             logging.error(f"Error loading alarm mapping: {e}")
             return []
     
-    def generate_log_number(self):
-        """Generate unique sequential log number
+    def save_alarm(self, alarm_info, machine_name):
+        """Save alarm event to database
         
-        Format: YYMMDDHH (8 digits) + 4-digit counter
-        Example: 25120100 (YY=25, MM=12, DD=01, HH=00) + 0001 = 251201000001
+        alarm_info may carry 'date_time' (time of acquisition); otherwise the
+        current time is used.
         """
-        current_time = datetime.now().strftime('%y%m%d%H')
-        
-        # Reset counter if hour changes
-        if current_time != self.last_date:
-            self.log_counter = 0
-            self.last_date = current_time
-        
-        # Increment counter
-        self.log_counter += 1
-        
-        # Generate log number with format: YYMMDDHH + counter (4 digits)
-        log_no = f"{current_time}{self.log_counter:04d}"
-        
-        return log_no
-    
-    def save_alarm(self, alarm_info, machine_name):
-        """Save alarm event to database"""
         try:
-            cursor = self.connection.cursor()
-            
-            log_no = self.generate_log_number()
-            
-            cursor.execute("""
-                INSERT INTO alarm_history 
-                (log_no, date_time, type, description, status, machine)
-                VALUES (%s, %s, %s, %s, %s, %s)
-            """, (
-                log_no,
-                datetime.now(),
+            row = (
+                alarm_info.get('date_time') or datetime.now(),
                 alarm_info['type'],
                 alarm_info['description'],
                 alarm_info['status'],
                 machine_name
-            ))
+            )
             
-            self.connection.commit()
-            cursor.close()
+            def operation(cursor):
+                self.insert_rows(cursor, [row])
+            
+            # Not retried: a lost commit may still have been applied
+            self.execute(operation, retry=False)
             
             logging.info(f"Alarm saved: {alarm_info['description']} - {alarm_info['status']}")
             return True
             
         except Exception as e:
+            self.clear_lookup_ids()
             logging.error(f"Error saving alarm to database: {e}")
-            self.connection.rollback()
             return False
     
+    def write_alarms(self, events):
+        """Write a batch of alarm events with one INSERT and commit
+        
+        Errors are raised, so the caller can tell rows the database rejects
+        (DATA_ERRORS) from failures worth retrying.
+        
+        Args:
+            events: List of dictionaries with date_time, type, description,
+                status and machine
+        """
+        rows = [
+            (
+                event['date_time'],
+                event['type'],
+                event['description'],
+                event['status'],
+                event['machine']
+            )
+            for event in events
+        ]
+        
+        def operation(cursor):
+            self.insert_rows(cursor, rows)
+        
+        try:
+            # Not retried: the event writer spools the batch if the write fails
+            self.execute(operation, retry=False)
+        except Exception:
+            self.clear_lookup_ids()
+            raise
+        
+        logging.info(f"Saved batch of {len(rows)} alarm events")
+    
+    def insert_rows(self, cursor, rows):
+        """Insert (date_time, type, description, status, machine) rows
+        
+        Log numbers come from the block reserved by the log number generator
+        (a new block is fetched on cursor when it runs out) and names are
+        replaced by their lookup ids. The prepared INSERT_ALARMS statement
+        runs with one array per column.
+        """
+        date_times, types, descriptions, statuses, machines = (list(column) for column in zip(*rows))
+        columns = [self.log_numbers.generate(cursor, date_times), date_times]
+        for column, names in (('type', types), ('description', descriptions),
+                              ('status', statuses), ('machine', machines)):
+            columns.append(self.resolve_lookup_ids(cursor, column, names))
+        self.run_query(cursor, INSERT_ALARMS, columns, prepare=True)
+    
+    def resolve_lookup_ids(self, cursor, column, names):
+        """Map names to their ids in the lookup table of column
+        
+        Ids are cached in the process, so only a name seen for the first
+        time costs a round trip (alarm_lookup_id adds it when it is new).
+        """
+        ids = self.lookup_ids[column]
+        for name in names:
+            if name not in ids:
+                cursor.execute("SELECT alarm_lookup_id(%s::regclass, %s)", (LOOKUP_TABLES[column], name))
+                ids[name] = cursor.fetchone()[0]
+        return [ids[name] for name in names]
+    
+    def clear_lookup_ids(self):
+        """Forget cached lookup ids (names added by a failed insert were rolled back)"""
+        for ids in self.lookup_ids.values():
+            ids.clear()
+    
+    def build_filter_clause(self, filters):
+        """Build the WHERE conditions for alarm history filters
+        
+        Args:
+            filters: Dictionary with optional filters (see get_alarm_history)
+        
+        Returns:
+            tuple: (" AND ..." SQL fragment, list of parameters)
+        """
+        query = ""
+        params = []
+        
+        if filters:
+            if filters.get('start_date'):
+                query += " AND date_time >= %s"
+                params.append(filters['start_date'])
+            
+            if filters.get('end_date'):
+                query += " AND date_time <= %s"
+                params.append(filters['end_date'])
+            
+            # Names are matched in the lookup tables and the history rows by
+            # id, so the conditions use the small id indexes
+            if filters.get('alarm_type') and filters['alarm_type'] != 'All':
+                query += " AND type_id = (SELECT id FROM alarm_types WHERE name = %s)"
+                params.append(filters['alarm_type'])
+            
+            if filters.get('status') and filters['status'] != 'All':
+                query += " AND status_id = ANY (ARRAY(SELECT id FROM alarm_statuses WHERE LOWER(name) = LOWER(%s)))"
+                params.append(filters['status'])
+            
+            if filters.get('machine') and filters['machine'] != 'All':
+                query += " AND machine_id = (SELECT id FROM alarm_machines WHERE name = %s)"
+                params.append(filters['machine'])
+            
+            if filters.get('description') and filters['description'] != 'All':
+                query += " AND description_id = (SELECT id FROM alarm_descriptions WHERE name = %s)"
+                params.append(filters['description'])
+            
+            if filters.get('search_text'):
+                # log_no is served by the pg_trgm index idx_alarm_history_search_trgm;
+                # LIKE wildcards typed by the user are matched literally
+                query += (" AND (description_id = ANY (ARRAY(SELECT id FROM alarm_descriptions WHERE name ILIKE %s))"
+                          " OR log_no ILIKE %s"
+                          " OR status_id = ANY (ARRAY(SELECT id FROM alarm_statuses WHERE name ILIKE %s)))")
+                search = f"%{escape_like(filters['search_text'])}%"
+                params.append(search)
+                params.append(search)
+                params.append(search)
+        
+        return query, params
+    
     def get_alarm_history(self, filters=None, limit=1000):
         """Get alarm history with optional filters
         
@@ -141,126 +558,587 @@ class DatabaseManager:
             List of alarm records
         """
         try:
-            cursor = self.connection.cursor()
+            conditions, params = self.build_filter_clause(filters)
+            query = ("SELECT log_no, date_time, type, description, status, machine FROM alarm_history WHERE 1=1"
+                     + conditions + " ORDER BY date_time DESC, id DESC LIMIT %s")
             
-            query = "SELECT log_no, date_time, type, description, status, machine FROM alarm_history WHERE 1=1"
-            params = []
+            return self.fetchall(query, params + [limit], prepare=True)
             
-            if filters:
-                if filters.get('start_date'):
-                    query += " AND date_time >= %s"
-                    params.append(filters['start_date'])
-                
-                if filters.get('end_date'):
-                    query += " AND date_time <= %s"
-                    params.append(filters['end_date'])
-                
-                if filters.get('alarm_type') and filters['alarm_type'] != 'All':
-                    query += " AND type = %s"
-                    params.append(filters['alarm_type'])
-                
-                if filters.get('status') and filters['status'] != 'All':
-                    query += " AND LOWER(COALESCE(status, '')) = LOWER(%s)"
-                    params.append(filters['status'])
-                
-                if filters.get('machine') and filters['machine'] != 'All':
-                    query += " AND machine = %s"
-                    params.append(filters['machine'])
-                
-                if filters.get('description') and filters['description'] != 'All':
-                    query += " AND description = %s"
-                    params.append(filters['description'])
-                
-                if filters.get('search_text'):
-                    query += " AND (description ILIKE %s OR log_no ILIKE %s OR status ILIKE %s)"
-                    search = f"%{filters['search_text']}%"
-                    params.append(search)
-                    params.append(search)
-                    params.append(search)
+        except Exception as e:
+            logging.error(f"Error retrieving alarm history: {e}")
+            return []
+    
+    def get_alarm_page(self, filters=None, page_size=500, cursor=None, direction=PAGE_OLDER):
+        """Get one page of alarm history, newest first, using keyset pagination
+        
+        Pages are addressed by the (date_time, id) key of their edge rows
+        instead of an OFFSET, so every page costs one index range scan on
+        (date_time, id) no matter how deep it is.
+        
+        Args:
+            filters: Dictionary with optional filters (see get_alarm_history)
+            page_size: Number of records per page
+            cursor: Token from a previous page (None for the newest page)
+            direction: PAGE_OLDER for the rows after cursor, PAGE_NEWER for
+                the rows before it
+        
+        Returns:
+            dict: rows (log_no, date_time, type, description, status, machine),
+                cursors (the cursor token of each row), older_cursor and
+                newer_cursor (None when there is no such page), and for the
+                newest page last_id and id_gaps (the highest id when it was
+                read and the ids below it not committed yet, to pass to
+                get_alarms_since)
+        """
+        page = {'rows': [], 'cursors': [], 'older_cursor': None, 'newer_cursor': None,
+                'last_id': None, 'id_gaps': []}
+        try:
+            if cursor is None:
+                # Read before the page so no row can fall between the two
+                page['last_id'], page['id_gaps'] = self.execute(self.read_high_water)
             
-            query += f" ORDER BY date_time DESC LIMIT {limit}"
+            conditions, params = self.build_filter_clause(filters)
+            newer = cursor is not None and direction == PAGE_NEWER
             
-            cursor.execute(query, params)
-            records = cursor.fetchall()
-            cursor.close()
+            if cursor is not None:
+                cursor_time, cursor_id = decode_page_cursor(cursor)
+                # The plain date_time bound lets PostgreSQL prune the monthly
+                # partitions; the row comparison alone does not
+                if newer:
+                    conditions += " AND date_time >= %s AND (date_time, id) > (%s, %s)"
+                else:
+                    conditions += " AND date_time <= %s AND (date_time, id) < (%s, %s)"
+                params.extend([cursor_time, cursor_time, cursor_id])
             
-            return records
+            order = "ASC" if newer else "DESC"
+            query = ("SELECT id, log_no, date_time, type, description, status, machine FROM alarm_history WHERE 1=1"
+                     + conditions + f" ORDER BY date_time {order}, id {order} LIMIT %s")
+            
+            # One extra row tells whether another page follows
+            rows = self.fetchall(query, params + [page_size + 1], prepare=True)
+            more = len(rows) > page_size
+            if newer and not more:
+                # Reached the newest rows: show the full newest page instead
+                return self.get_alarm_page(filters, page_size)
+            rows = rows[:page_size]
+            if newer:
+                rows.reverse()
+            if not rows:
+                return page
+            
+            page['rows'] = [row[1:] for row in rows]
+            page['cursors'] = [encode_page_cursor(row[2], row[0]) for row in rows]
+            first_key = page['cursors'][0]
+            last_key = page['cursors'][-1]
+            if newer:
+                page['newer_cursor'] = first_key
+                page['older_cursor'] = last_key
+            else:
+                page['newer_cursor'] = first_key if cursor is not None else None
+                page['older_cursor'] = last_key if more else None
+            return page
             
         except Exception as e:
-            logging.error(f"Error retrieving alarm history: {e}")
-            return []
+            logging.error(f"Error retrieving alarm history page: {e}")
+            return page
     
-    def get_distinct_descriptions(self):
-        """Get list of distinct descriptions for filter dropdown"""
+    def read_high_water(self, cursor):
+        """Read the highest id and the ids below it that are not visible yet
+        
+        Returns:
+            tuple: (highest id, ids within LATE_COMMIT_WINDOW below it that
+                are not committed yet)
+        """
+        self.run_query(cursor, "SELECT COALESCE(MAX(id), 0) FROM alarm_history", prepare=True)
+        max_id = cursor.fetchone()[0]
+        low_id = max(0, max_id - LATE_COMMIT_WINDOW)
+        self.run_query(cursor, "SELECT id FROM alarm_history WHERE id > %s AND id <= %s",
+                       [low_id, max_id], prepare=True)
+        visible = {row[0] for row in cursor.fetchall()}
+        return max_id, [row_id for row_id in range(low_id + 1, max_id + 1) if row_id not in visible]
+    
+    def get_alarms_since(self, last_id, filters=None, limit=500, id_gaps=None):
+        """Get records inserted after last_id that match filters
+        
+        Used to refresh the newest page incrementally: the queries are range
+        scans on the primary key, so their cost follows the number of new
+        rows.
+        
+        Ids are not committed in order when several processes write, so a
+        row below last_id can become visible after last_id was returned.
+        The ids that were not visible yet (id_gaps) are therefore looked up
+        again on every call until they fall more than LATE_COMMIT_WINDOW ids
+        behind. A row committed later than that only shows up when the page
+        is reloaded.
+        
+        Args:
+            last_id: last_id of the newest page or of the previous call
+            filters: Dictionary with optional filters (see get_alarm_history)
+            limit: Maximum number of new records
+            id_gaps: id_gaps of the newest page or of the previous call
+        
+        Returns:
+            dict: rows and cursors as in get_alarm_page (oldest first), last_id
+                and id_gaps for the next call and complete (False if more
+                than limit records arrived and the page should be reloaded);
+                None on error
+        """
         try:
-            cursor = self.connection.cursor()
-            cursor.execute("SELECT DISTINCT description FROM alarm_history ORDER BY description")
-            descriptions = ['All'] + [row[0] for row in cursor.fetchall()]
-            cursor.close()
-            return descriptions
+            id_gaps = [row_id for row_id in (id_gaps or ()) if row_id > last_id - LATE_COMMIT_WINDOW]
+            conditions, params = self.build_filter_clause(filters)
+            new_ids = "((id > %s AND id <= %s) OR id = ANY (%s::int[]))"
+            query = ("SELECT id, log_no, date_time, type, description, status, machine FROM alarm_history"
+                     " WHERE " + new_ids + conditions + " ORDER BY date_time, id LIMIT %s")
+            
+            def operation(cursor):
+                # Bound by the current MAX(id) so non-matching rows are skipped only once
+                self.run_query(cursor, "SELECT COALESCE(MAX(id), 0) FROM alarm_history", prepare=True)
+                max_id = cursor.fetchone()[0]
+                self.run_query(cursor, "SELECT id FROM alarm_history WHERE " + new_ids,
+                               [last_id, max_id, id_gaps], prepare=True)
+                visible = {row[0] for row in cursor.fetchall()}
+                self.run_query(cursor, query, [last_id, max_id, id_gaps] + params + [limit + 1], prepare=True)
+                return max_id, visible, cursor.fetchall()
+            
+            max_id, visible, rows = self.execute(operation)
+            complete = len(rows) <= limit
+            # Rows committed after the visibility check come again with their gap
+            rows = [row for row in rows[:limit] if row[0] in visible]
+            high_id = max(max_id, last_id)
+            missing = id_gaps + list(range(max(last_id, max_id - LATE_COMMIT_WINDOW) + 1, max_id + 1))
+            return {
+                'rows': [row[1:] for row in rows],
+                'cursors': [encode_page_cursor(row[2], row[0]) for row in rows],
+                'last_id': high_id,
+                'id_gaps': [row_id for row_id in missing
+                            if row_id not in visible and row_id > high_id - LATE_COMMIT_WINDOW],
+                'complete': complete
+            }
+            
         except Exception as e:
-            logging.error(f"Error retrieving descriptions: {e}")
-            return ['All']
+            logging.error(f"Error retrieving new alarm records: {e}")
+            return None
     
-    def get_distinct_statuses(self):
-        """Get list of distinct statuses for filter dropdown"""
+    def export_alarm_history(self, file, filters=None, progress=None, cancel_event=None):
+        """Stream every record matching filters to a CSV file
+        
+        The rows are produced by COPY ... TO STDOUT on the server and written
+        to the file as they arrive, so memory use does not grow with the
+        size of the result.
+        
+        Args:
+            file: Binary file object the CSV (UTF-8, with header) is written to
+            filters: Dictionary with optional filters (see get_alarm_history)
+            progress: Function called from the exporting thread with the
+                number of records written so far
+            cancel_event: threading.Event that aborts the export when set
+        
+        Returns:
+            int: Number of records written
+        
+        Raises:
+            ExportCancelled: cancel_event was set
+        """
+        conditions, params = self.build_filter_clause(filters)
+        query = EXPORT_QUERY + conditions + " ORDER BY date_time DESC, id DESC"
+        writer = CopyProgressWriter(
+            file,
+            progress=(lambda lines: progress(max(0, lines - 1))) if progress else None,
+            cancel_event=cancel_event
+        )
+        
+        def operation(cursor):
+            writer.connection = cursor.connection
+            select = cursor.mogrify(query, params)
+            cursor.copy_expert(b"COPY (" + select + b") TO STDOUT WITH (FORMAT csv, HEADER)", writer)
+        
         try:
-            cursor = self.connection.cursor()
-            cursor.execute("SELECT DISTINCT COALESCE(status, 'Unknown') FROM alarm_history WHERE status IS NOT NULL ORDER BY status")
-            statuses = ['All'] + [row[0] for row in cursor.fetchall() if row[0]]
-            cursor.close()
-            # Remove duplicates while preserving order
-            seen = set()
-            unique_statuses = []
-            for s in statuses:
-                if s not in seen:
-                    seen.add(s)
-                    unique_statuses.append(s)
-            return unique_statuses
+            # Not retried: part of the file may already be written
+            self.execute(operation, retry=False)
+        except extensions.QueryCanceledError:
+            if writer.cancelled or (cancel_event is not None and cancel_event.is_set()):
+                raise ExportCancelled("Export cancelled")
+            raise
+        if writer.cancelled:
+            # The COPY finished before the cancel reached the server
+            raise ExportCancelled("Export cancelled")
+        
+        records = max(0, writer.lines - 1)
+        logging.info(f"Exported {records} alarm records")
+        return records
+    
+    def get_filter_values(self, kind):
+        """Get the dropdown values of one filter from alarm_filter_values
+        
+        Results are cached for database.filter_cache_ttl seconds (default
+        300). The cache is cleared early when the notification listener hears
+        that new values were recorded.
+        
+        Args:
+            kind: 'description', 'status' or 'machine'
+        
+        Returns:
+            list: 'All' followed by the sorted values
+        """
+        cached = self.filter_values.get(kind)
+        if cached and cached[0] > time.monotonic():
+            return list(cached[1])
+        
+        try:
+            rows = self.fetchall("SELECT value FROM alarm_filter_values WHERE kind = %s ORDER BY value",
+                                 (kind,), prepare=True)
+            values = ['All'] + [row[0] for row in rows if row[0]]
+            self.filter_values[kind] = (time.monotonic() + self.filter_values_ttl, values)
+            return list(values)
         except Exception as e:
-            logging.error(f"Error retrieving statuses: {e}")
+            logging.error(f"Error retrieving {kind} filter values: {e}")
             return ['All']
     
+    def invalidate_filter_values(self):
+        """Drop the cached dropdown values so the next call reads them again"""
+        self.filter_values.clear()
+    
+    def get_distinct_descriptions(self):
+        """Get list of distinct descriptions for filter dropdown"""
+        return self.get_filter_values('description')
+    
+    def get_distinct_statuses(self):
+        """Get list of distinct statuses for filter dropdown"""
+        return self.get_filter_values('status')
+    
     def get_distinct_machines(self):
         """Get list of distinct machines for filter dropdown"""
+        return self.get_filter_values('machine')
+    
+    def get_record_count(self, filters=None, exact_limit=100000):
+        """Count the alarm records matching filters
+        
+        Uses the same conditions as get_alarm_history. Up to exact_limit
+        matching rows are counted exactly; beyond that the count stops and
+        the planner's row estimate for the filtered query is returned
+        instead, so a count over years of history stays fast.
+        
+        Args:
+            filters: Dictionary with optional filters (see get_alarm_history)
+            exact_limit: Largest count that is computed exactly
+        
+        Returns:
+            dict: count and exact (False when count is an estimate)
+        """
         try:
-            cursor = self.connection.cursor()
-            cursor.execute("SELECT DISTINCT machine FROM alarm_history ORDER BY machine")
-            machines = ['All'] + [row[0] for row in cursor.fetchall() if row[0]]
-            cursor.close()
-            return machines
+            conditions, params = self.build_filter_clause(filters)
+            query = "SELECT 1 FROM alarm_history WHERE 1=1" + conditions
+            
+            def operation(cursor):
+                self.run_query(cursor, f"SELECT COUNT(*) FROM ({query} LIMIT %s) AS matches",
+                               params + [exact_limit + 1], prepare=True)
+                count = cursor.fetchone()[0]
+                if count <= exact_limit:
+                    return {'count': count, 'exact': True}
+                
+                cursor.execute("EXPLAIN (FORMAT JSON) " + query, params)
+                plan = cursor.fetchone()[0]
+                if isinstance(plan, str):
+                    plan = json.loads(plan)
+                estimate = int(plan[0]['Plan']['Plan Rows'])
+                return {'count': max(estimate, count), 'exact': False}
+            
+            return self.execute(operation)
+            
         except Exception as e:
-            logging.error(f"Error retrieving machines: {e}")
-            return ['All']
+            logging.error(f"Error getting record count: {e}")
+            return {'count': 0, 'exact': False}
     
-    def get_record_count(self, filters=None):
-        """Get total count of alarm records with optional filters"""
-        try:
-            cursor = self.connection.cursor()
+    def build_rollup_clause(self, filters):
+        """Build the WHERE conditions on alarm_history_hourly for report filters
+        
+        start_date and end_date are rounded to whole hours: the buckets of
+        both edge hours are included.
+        
+        Args:
+            filters: Dictionary with optional start_date, end_date,
+                alarm_type, status, machine and description
+        
+        Returns:
+            tuple: (" AND ..." SQL fragment, list of parameters)
+        """
+        query = ""
+        params = []
+        
+        if filters:
+            if filters.get('start_date'):
+                query += " AND hour >= date_trunc('hour', %s::timestamp)"
+                params.append(filters['start_date'])
             
-            query = "SELECT COUNT(*) FROM alarm_history WHERE 1=1"
+            if filters.get('end_date'):
+                query += " AND hour <= %s"
+                params.append(filters['end_date'])
+            
+            for column, key in (('type', 'alarm_type'), ('status', 'status'),
+                                ('machine', 'machine'), ('description', 'description')):
+                if filters.get(key) and filters[key] != 'All':
+                    query += f" AND {column} = %s"
+                    params.append(filters[key])
+        
+        return query, params
+    
+    def get_top_alarms(self, filters=None, limit=10):
+        """Get the alarms that occurred most often
+        
+        Args:
+            filters: Report filters (see build_rollup_clause)
+            limit: Number of alarms to return
+        
+        Returns:
+            list: (description, machine, count) tuples, most frequent first
+        """
+        try:
+            conditions, params = self.build_rollup_clause(filters)
+            query = ("SELECT description, machine, SUM(count) AS total FROM alarm_history_hourly WHERE 1=1"
+                     + conditions + " GROUP BY description, machine ORDER BY total DESC, description LIMIT %s")
+            return self.fetchall(query, params + [limit], prepare=True)
+        except Exception as e:
+            logging.error(f"Error retrieving top alarms: {e}")
+            return []
+    
+    def get_alarm_frequency(self, filters=None, interval='day'):
+        """Get the number of alarm records per time interval
+        
+        Args:
+            filters: Report filters (see build_rollup_clause)
+            interval: 'hour', 'day', 'week' or 'month'
+        
+        Returns:
+            list: (interval start, count) tuples, oldest first; intervals
+                without records are left out
+        """
+        if interval not in ('hour', 'day', 'week', 'month'):
+            raise ValueError(f"Unsupported interval: {interval}")
+        
+        try:
+            conditions, params = self.build_rollup_clause(filters)
+            query = ("SELECT date_trunc(%s, hour) AS period, SUM(count) FROM alarm_history_hourly WHERE 1=1"
+                     + conditions + " GROUP BY period ORDER BY period")
+            return self.fetchall(query, [interval] + params, prepare=True)
+        except Exception as e:
+            logging.error(f"Error retrieving alarm frequency: {e}")
+            return []
+    
+    def get_machine_totals(self, filters=None):
+        """Get the number of alarm records per machine
+        
+        Args:
+            filters: Report filters (see build_rollup_clause)
+        
+        Returns:
+            list: (machine, alarms, events, total) tuples, busiest machine first
+        """
+        try:
+            conditions, params = self.build_rollup_clause(filters)
+            query = ("SELECT machine,"
+                     " SUM(count) FILTER (WHERE type = 'Alarm'),"
+                     " SUM(count) FILTER (WHERE type = 'Event'),"
+                     " SUM(count) AS total"
+                     " FROM alarm_history_hourly WHERE 1=1"
+                     + conditions + " GROUP BY machine ORDER BY total DESC, machine")
+            rows = self.fetchall(query, params, prepare=True)
+            return [(machine, alarms or 0, events or 0, total) for machine, alarms, events, total in rows]
+        except Exception as e:
+            logging.error(f"Error retrieving machine totals: {e}")
+            return []
+    
+    def get_active_alarms(self, machine=None):
+        """Get the alarms that are active now (open episodes)
+        
+        Args:
+            machine: Only alarms of this machine (default: all)
+        
+        Returns:
+            list: (description, machine, status, started_at, active seconds)
+                tuples, longest active first
+        """
+        try:
+            query = "SELECT description, machine, status, started_at FROM alarm_episodes WHERE ended_at IS NULL"
             params = []
+            if machine and machine != 'All':
+                query += " AND machine = %s"
+                params.append(machine)
+            rows = self.fetchall(query + " ORDER BY started_at", params, prepare=True)
             
-            if filters:
-                if filters.get('start_date'):
-                    query += " AND date_time >= %s"
-                    params.append(filters['start_date'])
-                
-                if filters.get('end_date'):
-                    query += " AND date_time <= %s"
-                    params.append(filters['end_date'])
+            now = datetime.now()
+            return [row + ((now - row[3]).total_seconds(),) for row in rows]
+        except Exception as e:
+            logging.error(f"Error retrieving active alarms: {e}")
+            return []
+    
+    def get_alarm_durations(self, start_date, end_date=None, machine=None, description=None):
+        """Get how long each alarm was active between start_date and end_date
+        
+        Episodes are clipped to the period, and open episodes count up to
+        now. MTTR is the mean duration of the episodes that were cleared.
+        
+        Args:
+            start_date: Start of the period
+            end_date: End of the period (default: now)
+            machine: Only alarms of this machine (default: all)
+            description: Only this alarm (default: all)
+        
+        Returns:
+            list: (description, machine, episodes, active seconds, MTTR
+                seconds or None, open episodes) tuples, longest active first
+        """
+        try:
+            now = datetime.now()
+            end_date = end_date or now
+            query = """
+                SELECT description, machine, COUNT(*),
+                       SUM(EXTRACT(EPOCH FROM LEAST(COALESCE(ended_at, %s), %s) - GREATEST(started_at, %s))),
+                       AVG(EXTRACT(EPOCH FROM duration)),
+                       COUNT(*) FILTER (WHERE ended_at IS NULL)
+                FROM alarm_episodes
+                WHERE tsrange(started_at, ended_at, '[]') && tsrange(%s, %s)
+                  AND started_at < %s AND (ended_at IS NULL OR ended_at > %s)"""
+            # The range test uses idx_alarm_episodes_period; the exact bounds are rechecked
+            params = [now, end_date, start_date, start_date, end_date, end_date, start_date]
             
-            cursor.execute(query, params)
-            count = cursor.fetchone()[0]
-            cursor.close()
+            if machine and machine != 'All':
+                query += " AND machine = %s"
+                params.append(machine)
+            if description and description != 'All':
+                query += " AND description = %s"
+                params.append(description)
             
-            return count
+            rows = self.fetchall(query + " GROUP BY description, machine ORDER BY 4 DESC", params, prepare=True)
+            return [
+                (name, machine_name, episodes, float(active or 0),
+                 float(mttr) if mttr is not None else None, open_episodes)
+                for name, machine_name, episodes, active, mttr, open_episodes in rows
+            ]
         except Exception as e:
-            logging.error(f"Error getting record count: {e}")
-            return 0
+            logging.error(f"Error retrieving alarm durations: {e}")
+            return []
+    
+    def maintain_partitions(self, months_ahead=3, retention_months=None, archive=False):
+        """Create future monthly partitions of alarm_history and apply retention
+        
+        Args:
+            months_ahead: Number of months after the current one to create
+                partitions for, so inserts never land in the default partition
+            retention_months: Full months kept before the current one; older
+                partitions are detached (None keeps everything)
+            archive: Keep detached partitions as alarm_history_archive_YYYY_MM
+                tables instead of dropping them
+        
+        Returns:
+            tuple: (partitions created, partitions removed), or None on error
+        """
+        try:
+            def operation(cursor):
+                cursor.execute("SELECT create_alarm_history_partitions(%s)", (months_ahead,))
+                created = cursor.fetchone()[0]
+                removed = 0
+                if retention_months is not None:
+                    cursor.execute("SELECT drop_alarm_history_partitions(%s, %s)",
+                                   (retention_months, archive))
+                    removed = cursor.fetchone()[0]
+                return created, removed
+            
+            created, removed = self.execute(operation, retry=False)
+            if created or removed:
+                logging.info(f"alarm_history partitions: {created} created, {removed} "
+                             f"{'archived' if archive else 'dropped'}")
+            return created, removed
+            
+        except Exception as e:
+            logging.error(f"Error maintaining alarm_history partitions: {e}")
+            return None
+    
+    def start_listener(self, callback, channel=NOTIFY_CHANNEL, retry_interval=5.0):
+        """Start a thread that LISTENs for new alarm_history rows
+        
+        The listener holds its own connection outside the pool. It is idle
+        until the insert trigger sends a notification and reconnects by itself
+        after the connection is lost. It also listens on FILTER_VALUES_CHANNEL
+        and clears the cached filter dropdown values when new ones appear.
+        
+        Args:
+            callback: Function called from the listener thread with the
+                highest new row id of each wake-up
+            channel: Notification channel (default: NOTIFY_CHANNEL)
+            retry_interval: Seconds between reconnect attempts
+        """
+        if self.listener_thread and self.listener_thread.is_alive():
+            return
+        
+        self.listener_stop.clear()
+        self.listener_thread = threading.Thread(
+            target=self.listen_loop, args=(callback, channel, retry_interval), daemon=True
+        )
+        self.listener_thread.start()
+    
+    def stop_listener(self, timeout=5):
+        """Stop the notification listener thread"""
+        self.listener_stop.set()
+        if self.listener_thread:
+            self.listener_thread.join(timeout=timeout)
+            self.listener_thread = None
+    
+    def listen_loop(self, callback, channel, retry_interval):
+        """Wait for notifications until stop_listener() is called"""
+        conn = None
+        while not self.listener_stop.is_set():
+            try:
+                if conn is None:
+                    conn = psycopg2.connect(**self.connect_kwargs())
+                    conn.autocommit = True
+                    with conn.cursor() as cursor:
+                        cursor.execute(sql.SQL("LISTEN {}").format(sql.Identifier(channel)))
+                        cursor.execute(sql.SQL("LISTEN {}").format(sql.Identifier(FILTER_VALUES_CHANNEL)))
+                    # Values recorded while not listening are unknown
+                    self.invalidate_filter_values()
+                    self.listening = True
+                    logging.info(f"Listening for notifications on {channel}")
+                
+                # Wake up every second to notice stop_listener()
+                if not select.select([conn], [], [], 1.0)[0]:
+                    continue
+                
+                conn.poll()
+                latest = None
+                while conn.notifies:
+                    notify = conn.notifies.pop(0)
+                    if notify.channel == FILTER_VALUES_CHANNEL:
+                        self.invalidate_filter_values()
+                        continue
+                    row_id = int(notify.payload) if notify.payload.isdigit() else 0
+                    latest = row_id if latest is None else max(latest, row_id)
+                
+                if latest is not None:
+                    try:
+                        callback(latest)
+                    except Exception as e:
+                        logging.error(f"Notification callback error: {e}")
+                    
+            except Exception as e:
+                self.listening = False
+                logging.error(f"Notification listener error: {e}")
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+                    conn = None
+                self.listener_stop.wait(retry_interval)
+        
+        self.listening = False
+        if conn is not None:
+            conn.close()
     
     def close(self):
-        """Close database connection"""
-        if self.connection and not self.connection.closed:
-            self.connection.close()
+        """Close the database connection pool"""
+        self.stop_listener()
+        
+        if self.pool and not self.pool.closed:
+            self.pool.close()
+            self.available = False
             logging.info("Database connection closed")
@@ -0,0 +1,152 @@
+"""
+Bounded, thread-safe pool of PostgreSQL connections with health checks.
+"""
+
+import logging
+import threading
+import time
+import psycopg2
+from psycopg2 import extensions
+from psycopg2.pool import PoolError
+
+
+class ConnectionPool:
+    """Bounded pool of psycopg2 connections checked out per operation
+
+    Connections are opened lazily up to max_size. A caller that finds every
+    connection in use waits up to timeout seconds for one to be returned.
+    Idle connections are checked before reuse: closed ones are discarded and
+    ones idle for longer than health_check_interval are pinged first.
+    """
+
+    def __init__(self, connect_kwargs, max_size=4, timeout=10.0, health_check_interval=30.0):
+        """Initialize pool
+
+        Args:
+            connect_kwargs: Keyword arguments for psycopg2.connect()
+            max_size: Maximum number of open connections
+            timeout: Seconds to wait for a free connection
+            health_check_interval: Idle seconds after which a connection is pinged before reuse
+        """
+        self.connect_kwargs = connect_kwargs
+        self.max_size = max(1, int(max_size))
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self.closed = False
+
+        self._slots = threading.BoundedSemaphore(self.max_size)
+        self._lock = threading.Lock()
+        self._idle = []  # (connection, last returned on the monotonic clock)
+        self._in_use = 0
+
+    def get(self):
+        """Check out a healthy connection
+
+        Returns:
+            connection: Open psycopg2 connection
+
+        Raises:
+            PoolError: No connection was returned within timeout, or the pool is closed
+            psycopg2.OperationalError: A new connection could not be opened
+        """
+        if self.closed:
+            raise PoolError("connection pool is closed")
+        if not self._slots.acquire(timeout=self.timeout):
+            raise PoolError(f"no database connection free within {self.timeout}s")
+
+        try:
+            conn = self._take_idle()
+            if conn is None:
+                conn = psycopg2.connect(**self.connect_kwargs)
+        except Exception:
+            self._slots.release()
+            raise
+
+        with self._lock:
+            self._in_use += 1
+        return conn
+
+    def _take_idle(self):
+        """Pop the most recently used idle connection that passes its health check"""
+        while True:
+            with self._lock:
+                if not self._idle:
+                    return None
+                conn, last_used = self._idle.pop()
+
+            if conn.closed:
+                continue
+            if time.monotonic() - last_used < self.health_check_interval:
+                return conn
+            if self._ping(conn):
+                return conn
+            self._close(conn)
+
+    @staticmethod
+    def _ping(conn):
+        """Check that an idle connection still reaches the server"""
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def put(self, conn, discard=False):
+        """Return a connection to the pool
+
+        Open transactions are rolled back. A connection that was lost (or
+        discard=True) is closed instead of being kept.
+        """
+        try:
+            if not discard and not conn.closed:
+                status = conn.info.transaction_status
+                if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+                    discard = True
+                elif status != extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+        except Exception as e:
+            logging.warning(f"Discarding database connection: {e}")
+            discard = True
+
+        if discard or conn.closed or self.closed:
+            self._close(conn)
+        else:
+            with self._lock:
+                self._idle.append((conn, time.monotonic()))
+
+        with self._lock:
+            self._in_use -= 1
+        self._slots.release()
+
+    def clear(self):
+        """Close all idle connections (after the server connection was lost)"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            self._close(conn)
+
+    def close(self):
+        """Close the pool and its idle connections
+
+        Connections still checked out are closed when they are returned.
+        """
+        self.closed = True
+        self.clear()
+
+    def get_status(self):
+        """Get pool statistics"""
+        with self._lock:
+            return {
+                'max_size': self.max_size,
+                'in_use': self._in_use,
+                'idle': len(self._idle)
+            }
@@ -0,0 +1,158 @@
+"""
+Durable on-disk spool for alarm events written while PostgreSQL is unavailable.
+"""
+
+import json
+import logging
+import sqlite3
+import threading
+from datetime import datetime
+from pathlib import Path
+
+
+class EventSpool:
+    """Append-only SQLite (WAL) spool of alarm events
+
+    Events are appended in batches inside one transaction, so each batch costs
+    a single fsync. Replay reads them back in insertion order. The spool is
+    bounded to max_events; when full the oldest events are discarded.
+
+    The spool also keeps a copy of the last loaded alarm mapping so the
+    monitor can start while the database is down.
+    """
+
+    def __init__(self, path='spool/alarm_events.db', max_events=1000000):
+        """Initialize spool
+
+        Args:
+            path: SQLite file of the spool (default: 'spool/alarm_events.db')
+            max_events: Maximum number of spooled events
+        """
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_events = max_events
+        self.dropped = 0
+        self.lock = threading.Lock()
+
+        self.connection = sqlite3.connect(str(self.path), check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=FULL")
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS spooled_events (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                date_time TEXT NOT NULL,
+                type TEXT NOT NULL,
+                description TEXT NOT NULL,
+                status TEXT NOT NULL,
+                machine TEXT NOT NULL
+            )
+        """)
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS alarm_mapping_cache (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                saved_at TEXT NOT NULL,
+                mappings TEXT NOT NULL
+            )
+        """)
+        self.connection.commit()
+
+        self.size = self.connection.execute("SELECT COUNT(*) FROM spooled_events").fetchone()[0]
+        if self.size:
+            logging.warning(f"Event spool {self.path} holds {self.size} events waiting for replay")
+
+    def append(self, events):
+        """Append a batch of events in one transaction
+
+        Args:
+            events: List of event dictionaries (date_time, type, description, status, machine)
+        """
+        if not events:
+            return
+
+        rows = [
+            (event['date_time'].isoformat(), event['type'], event['description'],
+             event['status'], event['machine'])
+            for event in events
+        ]
+        with self.lock:
+            with self.connection:
+                self.connection.executemany("""
+                    INSERT INTO spooled_events (date_time, type, description, status, machine)
+                    VALUES (?, ?, ?, ?, ?)
+                """, rows)
+                self.size += len(rows)
+
+                overflow = self.size - self.max_events
+                if overflow > 0:
+                    self.connection.execute("""
+                        DELETE FROM spooled_events WHERE id IN (
+                            SELECT id FROM spooled_events ORDER BY id LIMIT ?
+                        )
+                    """, (overflow,))
+                    self.size -= overflow
+                    self.dropped += overflow
+                    logging.error(f"Event spool full, discarded {overflow} oldest events")
+
+    def read_batch(self, limit):
+        """Read the oldest spooled events
+
+        Returns:
+            tuple: (last id, list of event dictionaries); (None, []) if empty
+        """
+        with self.lock:
+            rows = self.connection.execute("""
+                SELECT id, date_time, type, description, status, machine
+                FROM spooled_events
+                ORDER BY id
+                LIMIT ?
+            """, (limit,)).fetchall()
+
+        events = [
+            {
+                'date_time': datetime.fromisoformat(row[1]),
+                'type': row[2],
+                'description': row[3],
+                'status': row[4],
+                'machine': row[5]
+            }
+            for row in rows
+        ]
+        return (rows[-1][0] if rows else None), events
+
+    def delete_through(self, last_id):
+        """Remove replayed events up to and including last_id"""
+        with self.lock:
+            with self.connection:
+                deleted = self.connection.execute(
+                    "DELETE FROM spooled_events WHERE id <= ?", (last_id,)
+                ).rowcount
+                self.size = max(0, self.size - deleted)
+
+    def save_mapping(self, mappings):
+        """Cache the alarm mapping loaded from the database"""
+        with self.lock:
+            with self.connection:
+                self.connection.execute("""
+                    INSERT OR REPLACE INTO alarm_mapping_cache (id, saved_at, mappings)
+                    VALUES (1, ?, ?)
+                """, (datetime.now().isoformat(), json.dumps(mappings)))
+
+    def load_mapping(self):
+        """Load the cached alarm mapping
+
+        Returns:
+            list: Mapping dictionaries, empty if nothing was cached
+        """
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT saved_at, mappings FROM alarm_mapping_cache WHERE id = 1"
+            ).fetchone()
+        if not row:
+            return []
+        logging.warning(f"Using alarm mapping cached at {row[0]}")
+        return json.loads(row[1])
+
+    def close(self):
+        """Close the spool file"""
+        with self.lock:
+            self.connection.close()
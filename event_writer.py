@@ -0,0 +1,246 @@
+"""
+Write-behind queue that drains alarm events to the database in batches.
+"""
+
+import logging
+import queue
+import threading
+import time
+from database import DATA_ERRORS
+
+
+class AlarmEventWriter:
+    """Bounded in-process event queue drained by a dedicated writer thread
+
+    The scan threads only enqueue events. The writer thread collects them
+    into batches and flushes a batch with one multi-row INSERT and a single
+    commit when batch_size events are queued or flush_interval seconds have
+    passed since the first event of the batch.
+
+    A batch that cannot be written for any reason goes to the on-disk
+    spool, which is replayed in order before any newer event is written.
+    Only events the database keeps rejecting as invalid (DATA_ERRORS) are
+    discarded, one at a time after reject_attempts replays.
+    """
+
+    def __init__(self, db_manager, queue_size=10000, batch_size=500, flush_interval=0.5,
+                 spool=None, retry_interval=5.0, reject_attempts=3, replay_batches=4):
+        """Initialize event writer
+
+        Args:
+            db_manager: DatabaseManager used to write batches
+            queue_size: Maximum number of events waiting to be written
+            batch_size: Maximum number of events written per INSERT
+            flush_interval: Maximum seconds an event waits for its batch to fill
+            spool: EventSpool for events written while the database is down
+            retry_interval: Seconds between reconnect attempts while spooling
+            reject_attempts: Replays of an event rejected with a data error
+                before it is discarded
+            replay_batches: Spooled batches replayed between two reads of
+                the queue, so new events keep flowing while the spool drains
+        """
+        self.db_manager = db_manager
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.spool = spool
+        self.retry_interval = retry_interval
+        self.reject_attempts = reject_attempts
+        self.replay_batches = replay_batches
+        self.rejections = 0  # Consecutive data errors of the oldest spooled event
+        self.replay_size = batch_size  # 1 while looking for a rejected event
+        self.split_end = None  # Last spool id replayed one event at a time
+        self.next_replay = 0.0
+        self.running = False
+        self.writer_thread = None
+
+        self.written = 0
+        self.failed = 0
+        self.dropped = 0
+        self.batches = 0
+        self.spooled = 0
+        self.replayed = 0
+        self.rejected = 0
+
+    def start(self):
+        """Start the writer thread"""
+        if self.running:
+            return
+
+        self.running = True
+        self.writer_thread = threading.Thread(target=self.writer_loop, daemon=True)
+        self.writer_thread.start()
+        logging.info("Alarm event writer started")
+
+    def stop(self, timeout=10):
+        """Stop the writer thread after flushing queued events"""
+        if not self.running:
+            return
+
+        self.running = False
+        if self.writer_thread:
+            self.writer_thread.join(timeout=timeout)
+        logging.info("Alarm event writer stopped")
+
+    def put(self, event):
+        """Queue an alarm event without blocking the caller
+
+        Args:
+            event: Dictionary with date_time, type, description, status and machine
+
+        Returns:
+            bool: False if the queue is full and the event was dropped
+        """
+        try:
+            self.queue.put_nowait(event)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            logging.error(f"Alarm event queue full, dropped: {event['description']} - {event['status']}")
+            return False
+
+    def next_batch(self, timeout=None):
+        """Collect the next batch of events from the queue
+
+        Args:
+            timeout: Seconds to wait for the first event (default: flush_interval)
+
+        Returns:
+            list: Up to batch_size events, empty if none arrived in time
+        """
+        try:
+            batch = [self.queue.get(timeout=self.flush_interval if timeout is None else timeout)]
+        except queue.Empty:
+            return []
+
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    batch.append(self.queue.get(timeout=remaining))
+                else:
+                    batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def spool_batch(self, batch):
+        """Append a batch to the on-disk spool"""
+        self.spool.append(batch)
+        self.spooled += len(batch)
+
+    def flush(self, batch):
+        """Write one batch of events to the database (or the spool)"""
+        if self.spool is not None and self.spool.size:
+            # Keep order: newer events wait behind the spooled backlog
+            self.spool_batch(batch)
+            self.replay()
+            return
+
+        try:
+            if not self.db_manager.ensure_connected():
+                raise ConnectionError("database unavailable")
+            self.db_manager.write_alarms(batch)
+        except Exception as e:
+            if self.spool is None:
+                self.failed += len(batch)
+                logging.error(f"Error writing {len(batch)} alarm events: {e}")
+                return
+            logging.warning(f"Could not write alarm events ({e}), spooling {len(batch)} events")
+            self.spool_batch(batch)
+            self.next_replay = time.monotonic() + self.retry_interval
+            return
+
+        self.written += len(batch)
+        self.batches += 1
+
+    def replay(self):
+        """Replay spooled events in order once the database is reachable
+
+        At most replay_batches batches are written per call; the writer loop
+        calls again until the spool is empty. A batch failing with a data error is replayed one event at a time,
+        so only the event the database rejects is held back, and discarded
+        once it failed reject_attempts times.
+        """
+        now = time.monotonic()
+        if now < self.next_replay:
+            return
+
+        if not self.db_manager.ensure_connected():
+            self.next_replay = now + self.retry_interval
+            return
+
+        replayed = 0
+        for _ in range(self.replay_batches):
+            last_id, events = self.spool.read_batch(self.replay_size)
+            if not events:
+                break
+            if self.split_end is not None and last_id >= self.split_end:
+                self.replay_size = self.batch_size
+                self.split_end = None
+
+            try:
+                self.db_manager.write_alarms(events)
+            except DATA_ERRORS as e:
+                if len(events) > 1:
+                    # Find the rejected event
+                    self.replay_size = 1
+                    self.split_end = last_id
+                    continue
+                self.rejections += 1
+                if self.rejections < self.reject_attempts:
+                    logging.warning(f"Spooled alarm event rejected by the database "
+                                    f"({self.rejections}/{self.reject_attempts}): {e}")
+                    self.next_replay = now + self.retry_interval
+                    break
+                logging.error(f"Discarding spooled alarm event rejected {self.rejections} times: "
+                              f"{events[0]['description']} - {events[0]['status']}: {e}")
+                self.rejections = 0
+                self.rejected += 1
+                self.spool.delete_through(last_id)
+                continue
+            except Exception as e:
+                logging.warning(f"Replaying spooled alarm events failed, retrying later: {e}")
+                self.next_replay = now + self.retry_interval
+                break
+
+            self.rejections = 0
+            self.spool.delete_through(last_id)
+            replayed += len(events)
+            self.written += len(events)
+            self.batches += 1
+
+        if replayed:
+            self.replayed += replayed
+            logging.info(f"Replayed {replayed} spooled alarm events ({self.spool.size} left)")
+
+    def writer_loop(self):
+        """Drain the queue until stopped and empty"""
+        while self.running or not self.queue.empty():
+            # Do not wait for events while a spooled backlog can be replayed
+            backlog = (self.spool is not None and self.spool.size
+                       and time.monotonic() >= self.next_replay)
+            batch = self.next_batch(0 if backlog else None)
+            try:
+                if batch:
+                    self.flush(batch)
+                elif self.spool is not None and self.spool.size:
+                    self.replay()
+            except Exception as e:
+                self.failed += len(batch)
+                logging.error(f"Error writing alarm events: {e}")
+
+    def get_status(self):
+        """Get writer statistics"""
+        return {
+            'queued': self.queue.qsize(),
+            'written': self.written,
+            'failed': self.failed,
+            'dropped': self.dropped,
+            'batches': self.batches,
+            'spooled': self.spooled,
+            'replayed': self.replayed,
+            'rejected': self.rejected,
+            'spool_size': self.spool.size if self.spool is not None else 0
+        }
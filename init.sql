@@ -1,14 +1,109 @@
--- Create alarm history table
-CREATE TABLE IF NOT EXISTS alarm_history (
-    id SERIAL PRIMARY KEY,
+-- Lookup tables for the repeated text columns of the alarm history; every
+-- history row stores SMALLINT ids instead of the strings
+CREATE TABLE IF NOT EXISTS alarm_types (
+    id SMALLSERIAL PRIMARY KEY,
+    name VARCHAR(20) NOT NULL UNIQUE
+);
+
+CREATE TABLE IF NOT EXISTS alarm_descriptions (
+    id SMALLSERIAL PRIMARY KEY,
+    name VARCHAR(255) NOT NULL UNIQUE
+);
+
+CREATE TABLE IF NOT EXISTS alarm_statuses (
+    id SMALLSERIAL PRIMARY KEY,
+    name VARCHAR(20) NOT NULL UNIQUE
+);
+
+CREATE TABLE IF NOT EXISTS alarm_machines (
+    id SMALLSERIAL PRIMARY KEY,
+    name VARCHAR(100) NOT NULL UNIQUE
+);
+
+INSERT INTO alarm_types (name) VALUES ('Alarm'), ('Event');
+
+-- Id of a name in a lookup table, added when it is new (safe for
+-- concurrent writers)
+CREATE OR REPLACE FUNCTION alarm_lookup_id(lookup_table REGCLASS, lookup_name TEXT) RETURNS SMALLINT AS $$
+DECLARE
+    lookup_id SMALLINT;
+BEGIN
+    IF lookup_name IS NULL THEN
+        RETURN NULL;
+    END IF;
+
+    EXECUTE format('SELECT id FROM %s WHERE name = $1', lookup_table) INTO lookup_id USING lookup_name;
+    IF lookup_id IS NULL THEN
+        EXECUTE format('INSERT INTO %s (name) VALUES ($1) ON CONFLICT (name) DO NOTHING RETURNING id', lookup_table)
+            INTO lookup_id USING lookup_name;
+    END IF;
+    IF lookup_id IS NULL THEN
+        -- Added by a concurrent transaction in the meantime
+        EXECUTE format('SELECT id FROM %s WHERE name = $1', lookup_table) INTO lookup_id USING lookup_name;
+    END IF;
+    RETURN lookup_id;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Create alarm history storage, partitioned by month on date_time.
+-- The primary key of a partitioned table must contain the partition key.
+CREATE TABLE IF NOT EXISTS alarm_history_data (
+    id SERIAL NOT NULL,
     log_no VARCHAR(50) NOT NULL,
     date_time TIMESTAMP NOT NULL,
-    type VARCHAR(20) NOT NULL,
-    description VARCHAR(255) NOT NULL,
-    status VARCHAR(20) NOT NULL,
-    machine VARCHAR(100) NOT NULL,
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-);
+    type_id SMALLINT NOT NULL REFERENCES alarm_types(id),
+    description_id SMALLINT NOT NULL REFERENCES alarm_descriptions(id),
+    status_id SMALLINT NOT NULL REFERENCES alarm_statuses(id),
+    machine_id SMALLINT NOT NULL REFERENCES alarm_machines(id),
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (id, date_time)
+) PARTITION BY RANGE (date_time);
+
+-- Catches rows outside every monthly partition so inserts never fail
+CREATE TABLE IF NOT EXISTS alarm_history_default PARTITION OF alarm_history_data DEFAULT;
+
+-- alarm_history with the names resolved, for queries and compatibility.
+-- The joins are LEFT JOINs on unique keys, so PostgreSQL drops the ones a
+-- query does not use; the ids are exposed for index-friendly filters.
+CREATE OR REPLACE VIEW alarm_history AS
+SELECT h.id,
+       h.log_no,
+       h.date_time,
+       t.name AS type,
+       d.name AS description,
+       s.name AS status,
+       m.name AS machine,
+       h.created_at,
+       h.type_id,
+       h.description_id,
+       h.status_id,
+       h.machine_id
+FROM alarm_history_data h
+LEFT JOIN alarm_types t ON t.id = h.type_id
+LEFT JOIN alarm_descriptions d ON d.id = h.description_id
+LEFT JOIN alarm_statuses s ON s.id = h.status_id
+LEFT JOIN alarm_machines m ON m.id = h.machine_id;
+
+-- INSERT INTO alarm_history (log_no, date_time, type, description, status,
+-- machine) keeps working; names are resolved to ids
+CREATE OR REPLACE FUNCTION insert_alarm_history() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO alarm_history_data (log_no, date_time, type_id, description_id, status_id, machine_id, created_at)
+    VALUES (NEW.log_no, NEW.date_time,
+            alarm_lookup_id('alarm_types', NEW.type),
+            alarm_lookup_id('alarm_descriptions', NEW.description),
+            alarm_lookup_id('alarm_statuses', NEW.status),
+            alarm_lookup_id('alarm_machines', NEW.machine),
+            COALESCE(NEW.created_at, CURRENT_TIMESTAMP))
+    RETURNING id, created_at INTO NEW.id, NEW.created_at;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_alarm_history_insert
+    INSTEAD OF INSERT ON alarm_history
+    FOR EACH ROW
+    EXECUTE FUNCTION insert_alarm_history();
 
 -- Create alarm mapping table
 CREATE TABLE IF NOT EXISTS alarm_mapping (
@@ -30,11 +125,265 @@ CREATE TABLE IF NOT EXISTS alarm_mapping (
 );
 
 -- Create indexes for better performance
-CREATE INDEX idx_alarm_history_datetime ON alarm_history(date_time DESC);
-CREATE INDEX idx_alarm_history_type ON alarm_history(type);
-CREATE INDEX idx_alarm_history_status ON alarm_history(status);
-CREATE INDEX idx_alarm_history_machine ON alarm_history(machine);
-CREATE INDEX idx_alarm_history_log_no ON alarm_history(log_no);
+-- (date_time, id) is the keyset of the paged history view
+CREATE INDEX idx_alarm_history_datetime ON alarm_history_data(date_time DESC, id DESC);
+CREATE INDEX idx_alarm_history_type ON alarm_history_data(type_id);
+CREATE INDEX idx_alarm_history_description ON alarm_history_data(description_id);
+CREATE INDEX idx_alarm_history_status ON alarm_history_data(status_id);
+CREATE INDEX idx_alarm_history_machine ON alarm_history_data(machine_id);
+
+-- log_no is unique. On a partitioned table a unique constraint must include
+-- the partition key, so PostgreSQL enforces (log_no, date_time); the
+-- sequence below is what keeps log_no itself unique across writers
+ALTER TABLE alarm_history_data ADD CONSTRAINT uq_alarm_history_log_no UNIQUE (log_no, date_time);
+
+-- Log numbers are handed out in blocks: every nextval() reserves the next
+-- 1000 numbers for one writer (see log_generator.py). Starting at 10000
+-- keeps them apart from the old per-hour 4-digit counters.
+CREATE SEQUENCE IF NOT EXISTS alarm_log_no_seq INCREMENT BY 1000 START WITH 10000;
+
+-- Trigram index for the free-text search (ILIKE '%text%') on log_no; the
+-- description and status names are searched in their small lookup tables.
+-- B-tree indexes cannot serve a leading wildcard.
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE INDEX idx_alarm_history_search_trgm ON alarm_history_data USING gin (log_no gin_trgm_ops);
+
+-- Create the monthly partitions (alarm_history_YYYY_MM) from the month of
+-- from_date up to months_ahead months after the current month. Rows already
+-- in the default partition for a new month are moved into it.
+CREATE OR REPLACE FUNCTION create_alarm_history_partitions(
+    months_ahead INTEGER DEFAULT 3,
+    from_date DATE DEFAULT CURRENT_DATE
+) RETURNS INTEGER AS $$
+DECLARE
+    month_start DATE := date_trunc('month', from_date)::date;
+    last_month DATE := (date_trunc('month', CURRENT_DATE) + make_interval(months => months_ahead))::date;
+    month_end DATE;
+    partition_name TEXT;
+    created INTEGER := 0;
+BEGIN
+    WHILE month_start <= last_month LOOP
+        month_end := (month_start + INTERVAL '1 month')::date;
+        partition_name := 'alarm_history_' || to_char(month_start, 'YYYY_MM');
+
+        IF to_regclass(partition_name) IS NULL THEN
+            IF EXISTS (SELECT 1 FROM alarm_history_default
+                       WHERE date_time >= month_start AND date_time < month_end) THEN
+                EXECUTE format('CREATE TABLE %I (LIKE alarm_history_data INCLUDING DEFAULTS INCLUDING CONSTRAINTS)',
+                               partition_name);
+                EXECUTE format('WITH moved AS (DELETE FROM alarm_history_default
+                                               WHERE date_time >= %L AND date_time < %L RETURNING *)
+                                INSERT INTO %I SELECT * FROM moved',
+                               month_start, month_end, partition_name);
+                EXECUTE format('ALTER TABLE alarm_history_data ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                               partition_name, month_start, month_end);
+            ELSE
+                EXECUTE format('CREATE TABLE %I PARTITION OF alarm_history_data FOR VALUES FROM (%L) TO (%L)',
+                               partition_name, month_start, month_end);
+            END IF;
+            created := created + 1;
+        END IF;
+
+        month_start := month_end;
+    END LOOP;
+    RETURN created;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Retention: detach the monthly partitions that ended more than
+-- retain_months months before the current month. They are dropped, or kept
+-- as alarm_history_archive_YYYY_MM tables when archive is TRUE.
+CREATE OR REPLACE FUNCTION drop_alarm_history_partitions(
+    retain_months INTEGER,
+    archive BOOLEAN DEFAULT FALSE
+) RETURNS INTEGER AS $$
+DECLARE
+    cutoff DATE := (date_trunc('month', CURRENT_DATE) - make_interval(months => retain_months))::date;
+    partition_name TEXT;
+    removed INTEGER := 0;
+BEGIN
+    FOR partition_name IN
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'alarm_history_data'::regclass
+          AND c.relname ~ '^alarm_history_[0-9]{4}_[0-9]{2}$'
+        ORDER BY c.relname
+    LOOP
+        IF to_date(right(partition_name, 7), 'YYYY_MM') < cutoff THEN
+            EXECUTE format('ALTER TABLE alarm_history_data DETACH PARTITION %I', partition_name);
+            IF archive THEN
+                EXECUTE format('ALTER TABLE %I RENAME TO %I', partition_name,
+                               'alarm_history_archive_' || right(partition_name, 7));
+            ELSE
+                EXECUTE format('DROP TABLE %I', partition_name);
+            END IF;
+            removed := removed + 1;
+        END IF;
+    END LOOP;
+    RETURN removed;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Partitions for the sample data below and the next months
+SELECT create_alarm_history_partitions(3, '2025-01-01');
+
+-- Notify listeners (history GUI) of new rows; one notification per INSERT
+-- statement carrying the highest new id, so batch inserts notify once
+CREATE OR REPLACE FUNCTION notify_alarm_history_insert() RETURNS trigger AS $$
+DECLARE
+    last_id INTEGER;
+BEGIN
+    SELECT MAX(id) INTO last_id FROM new_rows;
+    IF last_id IS NOT NULL THEN
+        PERFORM pg_notify('alarm_history_insert', last_id::text);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_alarm_history_notify
+    AFTER INSERT ON alarm_history_data
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION notify_alarm_history_insert();
+
+-- Values offered by the history filter dropdowns, kept by a trigger so the
+-- GUI never runs SELECT DISTINCT over the whole history
+CREATE TABLE IF NOT EXISTS alarm_filter_values (
+    kind VARCHAR(20) NOT NULL,  -- description, status or machine
+    value VARCHAR(255) NOT NULL,
+    PRIMARY KEY (kind, value)
+);
+
+-- Record the values of new rows; listeners on alarm_filter_values are
+-- notified only when a value was not known before
+CREATE OR REPLACE FUNCTION record_alarm_filter_values() RETURNS trigger AS $$
+DECLARE
+    added INTEGER;
+BEGIN
+    INSERT INTO alarm_filter_values (kind, value)
+    SELECT DISTINCT v.kind, v.value
+    FROM new_rows r
+    JOIN alarm_descriptions d ON d.id = r.description_id
+    JOIN alarm_statuses s ON s.id = r.status_id
+    JOIN alarm_machines m ON m.id = r.machine_id,
+         LATERAL (VALUES ('description', d.name), ('status', s.name), ('machine', m.name)) AS v(kind, value)
+    ON CONFLICT DO NOTHING;
+    GET DIAGNOSTICS added = ROW_COUNT;
+    IF added > 0 THEN
+        PERFORM pg_notify('alarm_filter_values', added::text);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_alarm_history_filter_values
+    AFTER INSERT ON alarm_history_data
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION record_alarm_filter_values();
+
+-- Hourly counts per machine, description, type and status for reports;
+-- kept by a trigger and not affected by partition retention
+CREATE TABLE IF NOT EXISTS alarm_history_hourly (
+    hour TIMESTAMP NOT NULL,
+    machine VARCHAR(100) NOT NULL,
+    description VARCHAR(255) NOT NULL,
+    type VARCHAR(20) NOT NULL,
+    status VARCHAR(20) NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (hour, machine, description, type, status)
+);
+
+CREATE INDEX idx_alarm_history_hourly_machine ON alarm_history_hourly(machine, hour);
+
+-- Add the rows of each INSERT statement to their hourly buckets
+CREATE OR REPLACE FUNCTION rollup_alarm_history_hourly() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO alarm_history_hourly AS h (hour, machine, description, type, status, count)
+    SELECT date_trunc('hour', r.date_time), m.name, d.name, t.name, s.name, COUNT(*)
+    FROM new_rows r
+    JOIN alarm_types t ON t.id = r.type_id
+    JOIN alarm_descriptions d ON d.id = r.description_id
+    JOIN alarm_statuses s ON s.id = r.status_id
+    JOIN alarm_machines m ON m.id = r.machine_id
+    GROUP BY 1, 2, 3, 4, 5
+    ORDER BY 1, 2, 3, 4, 5  -- Same lock order for concurrent writers
+    ON CONFLICT (hour, machine, description, type, status)
+    DO UPDATE SET count = h.count + EXCLUDED.count;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_alarm_history_hourly
+    AFTER INSERT ON alarm_history_data
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION rollup_alarm_history_hourly();
+
+-- Alarm episodes: one row from each raise ('Alarm' row) to its clear
+-- (next 'Event' row of the same machine and description). Open episodes
+-- have no ended_at yet.
+CREATE TABLE IF NOT EXISTS alarm_episodes (
+    id BIGSERIAL PRIMARY KEY,
+    machine VARCHAR(100) NOT NULL,
+    description VARCHAR(255) NOT NULL,
+    status VARCHAR(20) NOT NULL,
+    started_at TIMESTAMP NOT NULL,
+    ended_at TIMESTAMP,
+    duration INTERVAL GENERATED ALWAYS AS (ended_at - started_at) STORED,
+    start_log_no VARCHAR(50) NOT NULL,
+    end_log_no VARCHAR(50)
+);
+
+-- At most one open episode per alarm; also serves the currently-active view
+CREATE UNIQUE INDEX idx_alarm_episodes_open ON alarm_episodes(machine, description) WHERE ended_at IS NULL;
+CREATE INDEX idx_alarm_episodes_description ON alarm_episodes(description, started_at);
+-- Episodes overlapping a period (open episodes reach to infinity), so a
+-- duration report for last week does not read every older episode
+CREATE INDEX idx_alarm_episodes_period ON alarm_episodes USING gist (tsrange(started_at, ended_at, '[]'));
+
+-- Open an episode on each raise and close it on the clear, in event order.
+-- A raise while the alarm is already open (service restart) keeps the
+-- original start; a clear without an open episode is ignored.
+CREATE OR REPLACE FUNCTION track_alarm_episodes() RETURNS trigger AS $$
+DECLARE
+    alarm_row RECORD;
+BEGIN
+    FOR alarm_row IN
+        SELECT r.id, r.log_no, r.date_time, t.name AS type, d.name AS description,
+               s.name AS status, m.name AS machine
+        FROM new_rows r
+        JOIN alarm_types t ON t.id = r.type_id
+        JOIN alarm_descriptions d ON d.id = r.description_id
+        JOIN alarm_statuses s ON s.id = r.status_id
+        JOIN alarm_machines m ON m.id = r.machine_id
+        ORDER BY r.date_time, r.id
+    LOOP
+        IF alarm_row.type = 'Alarm' THEN
+            INSERT INTO alarm_episodes (machine, description, status, started_at, start_log_no)
+            VALUES (alarm_row.machine, alarm_row.description, alarm_row.status,
+                    alarm_row.date_time, alarm_row.log_no)
+            ON CONFLICT (machine, description) WHERE ended_at IS NULL DO NOTHING;
+        ELSE
+            UPDATE alarm_episodes
+            SET ended_at = alarm_row.date_time, end_log_no = alarm_row.log_no
+            WHERE machine = alarm_row.machine
+              AND description = alarm_row.description
+              AND ended_at IS NULL
+              AND started_at <= alarm_row.date_time;
+        END IF;
+    END LOOP;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_alarm_history_episodes
+    AFTER INSERT ON alarm_history_data
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION track_alarm_episodes();
 
 -- Insert sample alarm mapping data
 INSERT INTO alarm_mapping (item, description, signal_type, open_status, close_status, enabled, alarm_status, priority, address, bit_no, rw, modbus_data_type, modbus_function, comments) VALUES
@@ -51,6 +400,20 @@ INSERT INTO alarm_mapping (item, description, signal_type, open_status, close_st
 (11, 'RECEIVING TERMINALS Sensor A fault', 'Boolean', 'NORMAL', 'FAULT', TRUE, 'CLOSE', 'HIGH', '0052', 0, 'R', 'Coil', '01: READ OUTPUT STATUS', NULL),
 (12, 'RECEIVING TERMINALS Sensor B fault', 'Boolean', 'NORMAL', 'FAULT', TRUE, 'CLOSE', 'HIGH', '0053', 0, 'R', 'Coil', '01: READ OUTPUT STATUS', NULL);
 
+-- Seed the lookup tables from the alarm mapping
+INSERT INTO alarm_descriptions (name)
+SELECT description FROM alarm_mapping ORDER BY item
+ON CONFLICT DO NOTHING;
+
+INSERT INTO alarm_statuses (name)
+SELECT status FROM (
+    SELECT 'Normal' AS status
+    UNION SELECT open_status FROM alarm_mapping
+    UNION SELECT close_status FROM alarm_mapping
+) AS statuses
+WHERE status IS NOT NULL
+ON CONFLICT DO NOTHING;
+
 -- Insert sample alarm history data
 INSERT INTO alarm_history (log_no, date_time, type, description, status, machine) VALUES
 ('8293150104', '2025-01-12 07:06:58', 'Alarm', 'Mastercomm Restart', 'Restart', 'Mastercomm'),
@@ -1,36 +1,57 @@
-import logging
+import threading
 
 
 class LogNumberGenerator:
-    """Generates unique sequential log numbers"""
-    
-    def __init__(self):
-        """Initialize log number generator"""
-        self.log_counter = 0
-        self.last_date = None
-    
-    def generate(self):
-        """Generate unique sequential log number
-        
-        Format: YYMMDDHH (8 digits) + 4-digit counter
-        Example: 25120100 (YY=25, MM=12, DD=01, HH=00) + 0001 = 251201000001
-        
+    """Generates unique log numbers from blocks of a database sequence
+
+    The sequence (alarm_log_no_seq in init.sql) advances by its increment on
+    every nextval(), so each call reserves a block of increment numbers for
+    this process. Numbers are handed out from the block without a database
+    round trip; a new block is only fetched when it runs out. Restarts and
+    several writers never reuse a number; unused numbers of a block are
+    skipped.
+    """
+
+    def __init__(self, sequence='alarm_log_no_seq'):
+        """Initialize log number generator
+
+        Args:
+            sequence: Name of the PostgreSQL sequence the blocks come from
+        """
+        self.sequence = sequence
+        self.lock = threading.Lock()
+        self.next_number = 0
+        self.block_end = 0  # First number after the current block
+
+    def fetch_block(self, cursor):
+        """Reserve the next block of numbers from the sequence"""
+        cursor.execute(
+            "SELECT nextval(%s::regclass), seqincrement FROM pg_sequence WHERE seqrelid = %s::regclass",
+            (self.sequence, self.sequence)
+        )
+        start, size = cursor.fetchone()
+        self.next_number = start
+        self.block_end = start + size
+
+    def generate(self, cursor, date_times):
+        """Generate one unique log number per event time
+
+        Format: YYMMDDHH of the event (8 digits) + sequence number
+        Example: 25120100 (YY=25, MM=12, DD=01, HH=00) + 10001 = 2512010010001
+
+        Args:
+            cursor: Cursor used to fetch a new block when needed (normally
+                the cursor of the INSERT, so no extra connection is used)
+            date_times: Event times, one per log number
+
         Returns:
-            str: Unique log number
+            list: Log numbers
         """
-        from datetime import datetime
-        
-        current_time = datetime.now().strftime('%y%m%d%H')
-        
-        # Reset counter if hour changes
-        if current_time != self.last_date:
-            self.log_counter = 0
-            self.last_date = current_time
-        
-        # Increment counter
-        self.log_counter += 1
-        
-        # Generate log number with format: YYMMDDHH + counter (4 digits)
-        log_no = f"{current_time}{self.log_counter:04d}"
-        
-        return log_no
+        log_numbers = []
+        with self.lock:
+            for date_time in date_times:
+                if self.next_number >= self.block_end:
+                    self.fetch_block(cursor)
+                log_numbers.append(f"{date_time:%y%m%d%H}{self.next_number}")
+                self.next_number += 1
+        return log_numbers
@@ -2,11 +2,17 @@ import time
 import logging
 from datetime import datetime
 from pymodbus.client import ModbusTcpClient
-from pymodbus.exceptions import ModbusException
+from pymodbus.exceptions import ConnectionException, ModbusException, ModbusIOException
 import threading
 import json
+from concurrent.futures import ThreadPoolExecutor
 from database import DatabaseManager
+from event_spool import EventSpool
+from event_writer import AlarmEventWriter
 from log_manager import setup_logger
+from modbus_device import load_devices, STATE_CONNECTED, STATE_CONNECTING, STATE_DISCONNECTED
+from scan_planner import FUNCTION_READ_COILS, pack_bits
+from scan_scheduler import ScanJob, ScanScheduler, OVERRUN_SKIP
 
 # Configure logging with daily rotation
 logger = setup_logger('alarm_service', log_dir='logs')
@@ -15,21 +21,54 @@ class ModbusAlarmMonitor:
     def __init__(self, config_file='app_config.json'):
         """Initialize Modbus Alarm Monitor"""
         self.config = self.load_config(config_file)
-        self.modbus_client = None
         self.db_manager = None
-        self.alarm_states = {}  # Track previous alarm states
+        self.event_spool = None
         self.running = False
         self.monitor_thread = None
+        self.executor = None
+        self.reconnect_executor = None
+        self.maintenance_thread = None
+        self.stop_event = threading.Event()
         
-        # Initialize database manager
-        self.db_manager = DatabaseManager(self.config)
+        # Initialize database manager (the monitor also starts without the database)
+        self.db_manager = DatabaseManager(self.config, required=False)
+        
+        # Write-behind queue so scans never wait on database round trips,
+        # backed by an on-disk spool while the database is unreachable
+        writer_config = self.config.get('event_writer', {})
+        self.event_spool = EventSpool(
+            path=writer_config.get('spool_path', 'spool/alarm_events.db'),
+            max_events=writer_config.get('spool_max_events', 1000000)
+        )
+        self.event_writer = AlarmEventWriter(
+            self.db_manager,
+            queue_size=writer_config.get('queue_size', 10000),
+            batch_size=writer_config.get('batch_size', 500),
+            flush_interval=writer_config.get('flush_interval', 0.5),
+            spool=self.event_spool,
+            retry_interval=writer_config.get('retry_interval', 5.0),
+            reject_attempts=writer_config.get('reject_attempts', 3),
+            replay_batches=writer_config.get('replay_batches', 4)
+        )
         
         # Load alarm mapping from database
-        self.alarm_mapping = self.db_manager.load_alarm_mapping()
+        self.alarm_mapping = self.load_alarm_mapping()
+        
+        # Devices to poll, each with its own block-read scan plan per scan class
+        self.devices = load_devices(self.config, self.alarm_mapping)
+        self.scan_jobs = [
+            ScanJob(device, scan_class)
+            for device in self.devices
+            for scan_class in device.scan_classes
+        ]
+        for device in self.devices:
+            logger.info(f"{device}: {len(device.points)} points in "
+                        f"{len(device.scan_windows)} block reads, scan classes {device.scan_classes}")
         
         logger.info("Modbus Alarm Monitor initialized")
     
-    def load_config(self, config_file):
+    @staticmethod
+    def load_config(config_file):
         """Load configuration from JSON file"""
         try:
             with open(config_file, 'r') as f:
@@ -54,148 +93,348 @@ class ModbusAlarmMonitor:
                     "timeout": 3,
                     "reconnect_delay": 0.1,
                     "reconnect_delay_max": 300,
-                    "retries": 3
+                    "retries": 3,
+                    "max_read_gap": 16,
+                    "engine": "thread",
+                    "async_connections": 2,
+                    "devices": []
                 },
                 "database": {
                     "host": "localhost",
                     "port": 5432,
                     "database": "alarm_history",
                     "user": "admin",
-                    "password": "admin123"
+                    "password": "admin123",
+                    "pool_size": 4,
+                    "pool_timeout": 10,
+                    "health_check_interval": 30,
+                    "partitions": {
+                        "months_ahead": 3,
+                        "retention_months": 24,
+                        "archive": False,
+                        "check_interval": 86400
+                    }
+                },
+                "event_writer": {
+                    "queue_size": 10000,
+                    "batch_size": 500,
+                    "flush_interval": 0.5,
+                    "spool_path": "spool/alarm_events.db",
+                    "spool_max_events": 1000000,
+                    "retry_interval": 5.0,
+                    "reject_attempts": 3,
+                    "replay_batches": 4
                 },
                 "monitoring": {
                     "scan_interval": 1.0,
-                    "machine_name": "Mastercomm"
+                    "machine_name": "Mastercomm",
+                    "scan_workers": 8,
+                    "reconnect_workers": 2,
+                    "overrun_policy": "skip",
+                    "scan_classes": {
+                        "HIGH": 0.5,
+                        "MEDIUM": 1.0,
+                        "LOW": 5.0
+                    }
                 }
             }
     
-    def connect_modbus(self):
-        """Connect to Modbus TCP server"""
+    def load_alarm_mapping(self):
+        """Load alarm mapping from the database, or from the spool cache if it is down"""
+        if self.db_manager.is_connected():
+            mappings = self.db_manager.load_alarm_mapping()
+            if mappings:
+                self.event_spool.save_mapping(mappings)
+                return mappings
+        
+        logger.warning("Alarm mapping not available from database. Using cached mapping.")
+        return self.event_spool.load_mapping()
+    
+    def connect_modbus(self, device):
+        """Connect to the Modbus TCP server of a device
+        
+        The new client is connected before it replaces the old one, so a
+        scan of the device never waits on the connect timeout. A failure
+        schedules the next attempt on the device backoff.
+        """
+        modbus_config = self.config['modbus']
+        client = None
         try:
-            modbus_config = self.config['modbus']
-            
-            # Get mode and select host configuration
-            mode = modbus_config.get('mode', 'real')
-            host_config = modbus_config['hosts'][mode]
+            logger.info(f"Connecting to Modbus device {device.name}")
             
-            logger.info(f"Connecting to Modbus in {mode.upper()} mode")
-            
-            self.modbus_client = ModbusTcpClient(
-                host=host_config['host'],
-                port=host_config['port'],
+            client = ModbusTcpClient(
+                host=device.host,
+                port=device.port,
                 timeout=modbus_config['timeout'],
                 retries=modbus_config['retries']
             )
-            
-            if self.modbus_client.connect():
-                logger.info(f"Modbus connected to {host_config['host']}:{host_config['port']} ({mode.upper()} mode)")
-                return True
-            else:
-                logger.error("Failed to connect to Modbus server")
-                return False
+            connected = client.connect()
                 
         except Exception as e:
-            logger.error(f"Modbus connection error: {e}")
+            logger.error(f"Modbus connection error ({device.name}): {e}")
+            connected = False
+        
+        if not connected:
+            if client:
+                client.close()
+            device.connection_state = STATE_DISCONNECTED
+            delay = device.backoff.failure()
+            logger.error(f"Failed to connect to Modbus device {device.name} "
+                         f"(attempt {device.backoff.attempts}, retry in {delay:.1f}s)")
             return False
+        
+        with device.scan_lock:
+            if device.client:
+                device.client.close()
+            device.client = client
+        # The backoff is only reset by the first good read, so a device that
+        # accepts the connection and then drops it keeps backing off
+        device.connection_state = STATE_CONNECTED
+        logger.info(f"Modbus connected to {device.host}:{device.port} ({device.name})")
+        return True
+    
+    def schedule_reconnect(self, device):
+        """Start a background reconnect of a device once its backoff has expired"""
+        if device.connection_state == STATE_CONNECTING or not device.backoff.ready():
+            return
+        if self.reconnect_executor is None:
+            return
+        device.connection_state = STATE_CONNECTING
+        self.reconnect_executor.submit(self.connect_modbus, device)
+    
+    def mark_disconnected(self, device, reason):
+        """Drop the connection of a device after an I/O failure"""
+        logger.warning(f"Modbus device {device.name} disconnected: {reason}")
+        if device.client:
+            device.client.close()
+        device.connection_state = STATE_DISCONNECTED
+        device.backoff.failure()
     
-    def read_coil(self, address, count=1):
+    def is_modbus_connected(self, device):
+        """Check if the Modbus connection of a device is open"""
+        return device.client is not None and device.client.is_socket_open()
+    
+    def read_coil(self, device, address, count=1):
         """Read coil status from Modbus (Function Code 01)"""
         try:
-            response = self.modbus_client.read_coils(address, count=count)
+            response = device.client.read_coils(address, count=count, device_id=device.unit_id)
             if not response.isError():
                 return response.bits[:count]
             else:
-                logger.error(f"Error reading coil at address {address}")
+                logger.error(f"Error reading coil at address {address} ({device.name})")
                 return None
+        except (ConnectionException, ModbusIOException):
+            raise  # The connection is gone: read_windows() stops the scan
         except ModbusException as e:
-            logger.error(f"Modbus exception reading coil {address}: {e}")
+            logger.error(f"Modbus exception reading coil {address} ({device.name}): {e}")
             return None
     
-    def read_discrete_input(self, address, count=1):
+    def read_discrete_input(self, device, address, count=1):
         """Read discrete input from Modbus (Function Code 02)"""
         try:
-            response = self.modbus_client.read_discrete_inputs(address, count=count)
+            response = device.client.read_discrete_inputs(address, count=count, device_id=device.unit_id)
             if not response.isError():
                 return response.bits[:count]
             else:
-                logger.error(f"Error reading discrete input at address {address}")
+                logger.error(f"Error reading discrete input at address {address} ({device.name})")
                 return None
+        except (ConnectionException, ModbusIOException):
+            raise  # The connection is gone: read_windows() stops the scan
         except ModbusException as e:
-            logger.error(f"Modbus exception reading discrete input {address}: {e}")
+            logger.error(f"Modbus exception reading discrete input {address} ({device.name}): {e}")
             return None
     
-    def save_alarm_to_database(self, alarm_info):
-        """Save alarm event to database"""
-        self.db_manager.save_alarm(alarm_info, self.config['monitoring']['machine_name'])
+    def save_alarm_to_database(self, alarm_info, machine_name):
+        """Queue alarm event for the database writer"""
+        alarm_info['machine'] = machine_name
+        self.event_writer.put(alarm_info)
     
-    def process_alarm(self, mapping, current_state):
-        """Process alarm state change"""
-        item = mapping['item']
-        previous_state = self.alarm_states.get(item, False)
+    def process_alarm(self, device, point, current_state, acquired_at=None):
+        """Process alarm state change
+        
+        Args:
+            device: ModbusDevice the point was read from
+            point: AlarmPoint of the mapping
+            current_state: State read from the device
+            acquired_at: Time the state was read (default: now)
+        """
+        previous_state = device.alarm_states[point.index]
         
         # Detect state change
         if current_state != previous_state:
+            # Built once and handed to the event writer as is
             alarm_info = {
+                'date_time': acquired_at or datetime.now(),
                 'type': 'Alarm' if current_state else 'Event',
-                'description': mapping['description'],
-                'status': mapping['close_status'] if current_state else 'Normal',
-                'priority': mapping['priority']
+                'description': point.description,
+                'status': point.close_status if current_state else 'Normal'
             }
             
             # Save to database
-            self.save_alarm_to_database(alarm_info)
+            self.save_alarm_to_database(alarm_info, device.machine_name)
             
             # Update state
-            self.alarm_states[item] = current_state
+            device.alarm_states[point.index] = current_state
             
             # Log state change
             state_text = "ACTIVE" if current_state else "CLEARED"
-            logger.info(f"Alarm {item}: {mapping['description']} - {state_text}")
+            logger.info(f"Alarm {point.item} ({device.name}): {point.description} - {state_text}")
+    
+    def process_window(self, device, window, bits, acquired_at=None):
+        """Process a block read by diffing it against the previous image
+        
+        The window image is XORed with the previous one, and process_alarm
+        runs only for the mapped points whose bit flipped. A quiet window
+        costs a single integer comparison.
+        """
+        image = pack_bits(bits[:window.count])
+        changed = (image ^ window.image) & window.mask
+        if not changed:
+            return
+        
+        failed = 0
+        pending = changed
+        while pending:
+            bit = pending & -pending
+            pending ^= bit
+            offset = (bit.bit_length() - 1) >> 3
+            current_state = 1 if image & bit else 0
+            for point in window.points_by_offset[offset]:
+                try:
+                    self.process_alarm(device, point, current_state, acquired_at)
+                except Exception as e:
+                    # Keep the old bit so the change is retried on the next scan
+                    failed |= bit
+                    logger.error(f"Error processing alarm {point.description} ({device.name}): {e}")
+        
+        window.image = image ^ failed
     
-    def scan_alarms(self):
-        """Scan all configured alarms"""
-        if not self.modbus_client or not self.modbus_client.is_socket_open():
-            logger.warning("Modbus not connected. Attempting reconnection...")
-            if not self.connect_modbus():
+    def scan_device(self, device, windows=None):
+        """Scan configured alarms of one device
+        
+        Args:
+            device: ModbusDevice to scan
+            windows: ScanWindow objects to read (default: all windows of the device)
+        """
+        with device.scan_lock:
+            if device.connection_state != STATE_CONNECTED or not self.is_modbus_connected(device):
+                # Reconnect off the scan path; the scan resumes once it succeeds
+                if device.connection_state == STATE_CONNECTED:
+                    self.mark_disconnected(device, "connection lost")
+                self.schedule_reconnect(device)
                 return
+            
+            self.read_windows(device, device.scan_windows if windows is None else windows)
+    
+    def read_windows(self, device, windows):
+        """Read block windows from a device and process each point
         
-        for mapping in self.alarm_mapping:
+        The scan stops at the first window that fails because the connection
+        is gone, so a silent device costs one timeout per scan, not one per
+        window, and the background reconnect takes over.
+        """
+        for window in windows:
             try:
-                address = mapping['address']
+                # Read the whole window with a single request
+                if window.function_code == FUNCTION_READ_COILS:  # Read Coils
+                    result = self.read_coil(device, window.start, window.count)
+                else:  # Read Discrete Inputs
+                    result = self.read_discrete_input(device, window.start, window.count)
+                acquired_at = datetime.now()
                 
-                # Read based on Modbus function
-                if '01' in mapping['modbus_function']:  # Read Coils
-                    result = self.read_coil(address)
-                elif '02' in mapping['modbus_function']:  # Read Discrete Inputs
-                    result = self.read_discrete_input(address)
-                else:
-                    logger.warning(f"Unsupported Modbus function for {mapping['description']}")
+                if result is None or len(result) < window.count:
+                    if not self.is_modbus_connected(device):
+                        self.mark_disconnected(device, f"connection closed reading {window}")
+                        break
                     continue
                 
-                if result is not None and len(result) > 0:
-                    current_state = result[0]
-                    self.process_alarm(mapping, current_state)
+                device.backoff.success()
+                
+                # Split the changed bits back out to each mapping
+                self.process_window(device, window, result, acquired_at)
                     
+            except (OSError, ConnectionException, ModbusIOException) as e:
+                self.mark_disconnected(device, e)
+                break
             except Exception as e:
-                logger.error(f"Error scanning alarm {mapping['description']}: {e}")
+                logger.error(f"Error scanning {window} ({device.name}): {e}")
+    
+    def run_scan_job(self, job, deadline):
+        """Scan one job and record its cycle timing"""
+        started = time.monotonic()
+        try:
+            self.scan_device(job.device, job.scan_class.windows)
+        finally:
+            job.stats.record(deadline, started, time.monotonic())
+    
+    def submit_scan(self, job, deadline):
+        """Run a due scan job on the worker pool
+        
+        A job whose previous scan is still running (slow or dead outstation)
+        is skipped for this period so it never delays the other devices.
+        """
+        if job.is_pending():
+            logger.debug(f"{job} still in progress, skipping")
+            job.stats.skipped += 1
+            return
+        job.pending = self.executor.submit(self.run_scan_job, job, deadline)
+    
+    def build_scheduler(self):
+        """Create the timer queue with every scan job due immediately"""
+        scheduler = ScanScheduler(
+            overrun_policy=self.config['monitoring'].get('overrun_policy', OVERRUN_SKIP)
+        )
+        for job in self.scan_jobs:
+            scheduler.add(job)
+        return scheduler
     
     def monitoring_loop(self):
-        """Main monitoring loop"""
-        scan_interval = self.config['monitoring']['scan_interval']
+        """Main monitoring loop: dispatch scan jobs as their deadlines come due"""
+        scheduler = self.build_scheduler()
         
         logger.info("Monitoring started")
         
         while self.running:
             try:
-                self.scan_alarms()
-                time.sleep(scan_interval)
+                delay = scheduler.time_until_next()
+                if delay > 0:
+                    self.stop_event.wait(delay)
+                    continue
+                
+                for job, deadline in scheduler.pop_due():
+                    self.submit_scan(job, deadline)
                 
             except KeyboardInterrupt:
                 logger.info("Monitoring interrupted by user")
                 break
             except Exception as e:
                 logger.error(f"Error in monitoring loop: {e}")
-                time.sleep(5)  # Wait before retry
+                # Missed deadlines are skipped/compressed by the scheduler
+                self.stop_event.wait(self.config['monitoring']['scan_interval'])
+    
+    def partition_maintenance_loop(self):
+        """Keep future alarm_history partitions created and apply retention
+        
+        Runs at start and then every database.partitions.check_interval
+        seconds; a failed run (database down) is retried after a minute.
+        """
+        partition_config = self.config['database'].get('partitions', {})
+        interval = partition_config.get('check_interval', 86400)
+        
+        while self.running:
+            result = self.db_manager.maintain_partitions(
+                months_ahead=partition_config.get('months_ahead', 3),
+                retention_months=partition_config.get('retention_months'),
+                archive=partition_config.get('archive', False)
+            )
+            self.stop_event.wait(interval if result is not None else min(interval, 60))
+    
+    def start_maintenance(self):
+        """Start the partition maintenance thread (call after running is set)"""
+        self.maintenance_thread = threading.Thread(
+            target=self.partition_maintenance_loop, name='partition-maintenance', daemon=True
+        )
+        self.maintenance_thread.start()
     
     def start(self):
         """Start alarm monitoring"""
@@ -203,14 +442,32 @@ class ModbusAlarmMonitor:
             logger.warning("Monitor is already running")
             return
         
-        # Connect to Modbus
-        if not self.connect_modbus():
-            logger.error("Cannot start monitoring - Modbus connection failed")
-            return
+        # One worker per scan job (bounded by monitoring.scan_workers)
+        workers = self.config['monitoring'].get('scan_workers', 8)
+        self.executor = ThreadPoolExecutor(
+            max_workers=max(1, min(workers, len(self.scan_jobs))),
+            thread_name_prefix='modbus-scan'
+        )
+        # Reconnects block for the connect timeout, so they get their own
+        # workers and dead devices never hold the scan workers
+        self.reconnect_executor = ThreadPoolExecutor(
+            max_workers=max(1, self.config['monitoring'].get('reconnect_workers', 2)),
+            thread_name_prefix='modbus-reconnect'
+        )
+        
+        # Connect to all devices in parallel; unreachable devices are
+        # retried in the background with backoff
+        connected = list(self.executor.map(self.connect_modbus, self.devices))
+        if not any(connected):
+            logger.warning("No Modbus device reachable yet - retrying in background")
+        
+        self.event_writer.start()
         
         self.running = True
+        self.stop_event.clear()
         self.monitor_thread = threading.Thread(target=self.monitoring_loop, daemon=True)
         self.monitor_thread.start()
+        self.start_maintenance()
         
         logger.info("Alarm monitoring started")
     
@@ -221,23 +478,63 @@ class ModbusAlarmMonitor:
             return
         
         self.running = False
+        self.stop_event.set()
         
         if self.monitor_thread:
             self.monitor_thread.join(timeout=5)
         
-        if self.modbus_client:
-            self.modbus_client.close()
+        if self.maintenance_thread:
+            self.maintenance_thread.join(timeout=5)
+            self.maintenance_thread = None
+        
+        if self.executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+        if self.reconnect_executor:
+            self.reconnect_executor.shutdown(wait=False, cancel_futures=True)
+            self.reconnect_executor = None
+        
+        for device in self.devices:
+            if device.client:
+                device.client.close()
+        
+        # Flush events still waiting in the write-behind queue
+        self.event_writer.stop()
         
         logger.info("Alarm monitoring stopped")
     
     def get_status(self):
         """Get current monitoring status"""
+        devices = [
+            {
+                'name': device.name,
+                'host': device.host,
+                'port': device.port,
+                'machine': device.machine_name,
+                'connected': self.is_modbus_connected(device),
+                'connection_state': device.connection_state,
+                'reconnect_attempts': device.backoff.attempts,
+                'reconnect_in': (round(device.backoff.time_to_retry(), 1)
+                                 if device.connection_state == STATE_DISCONNECTED else 0.0),
+                'active_alarms': device.active_alarm_count(),
+                'total_monitored': len(device.points)
+            }
+            for device in self.devices
+        ]
         status = {
             'running': self.running,
-            'modbus_connected': self.modbus_client.is_socket_open() if self.modbus_client else False,
+            'modbus_connected': any(device['connected'] for device in devices),
             'database_connected': self.db_manager.is_connected(),
-            'active_alarms': sum(1 for state in self.alarm_states.values() if state),
-            'total_monitored': len(self.alarm_mapping)
+            'active_alarms': sum(device['active_alarms'] for device in devices),
+            'total_monitored': sum(device['total_monitored'] for device in devices),
+            'devices': devices,
+            'overruns': sum(job.stats.overruns for job in self.scan_jobs),
+            'skipped_cycles': sum(job.stats.skipped for job in self.scan_jobs),
+            'event_writer': self.event_writer.get_status(),
+            'scan_cycles': [
+                dict(device=job.device.name, scan_class=job.scan_class.name, **job.stats.as_dict())
+                for job in self.scan_jobs
+            ]
         }
         return status
     
@@ -247,6 +544,30 @@ class ModbusAlarmMonitor:
         
         if self.db_manager:
             self.db_manager.close()
+        
+        if self.event_spool:
+            self.event_spool.close()
+
+def create_monitor(config_file='app_config.json'):
+    """Create the alarm monitor for the engine selected in config
+    
+    modbus.engine selects the scan engine:
+        - "thread": blocking ModbusTcpClient in a monitor thread (default)
+        - "async": AsyncModbusTcpClient with concurrent window reads
+    
+    Returns:
+        ModbusAlarmMonitor or AsyncModbusAlarmMonitor
+    """
+    config = ModbusAlarmMonitor.load_config(config_file)
+    engine = config['modbus'].get('engine', 'thread')
+    
+    if engine == 'async':
+        from async_modbus_alarm_service import AsyncModbusAlarmMonitor
+        return AsyncModbusAlarmMonitor(config_file)
+    
+    if engine != 'thread':
+        logger.warning(f"Unknown Modbus engine '{engine}'. Using thread engine.")
+    return ModbusAlarmMonitor(config_file)
 
 def main():
     """Main function for standalone execution"""
@@ -254,7 +575,7 @@ def main():
     print("Modbus Alarm Monitoring Service")
     print("=" * 60)
     
-    monitor = ModbusAlarmMonitor()
+    monitor = create_monitor()
     
     try:
         monitor.start()
@@ -268,7 +589,20 @@ def main():
             print(f"\nStatus: Running={status['running']}, "
                   f"Modbus={status['modbus_connected']}, "
                   f"DB={status['database_connected']}, "
-                  f"Active Alarms={status['active_alarms']}/{status['total_monitored']}")
+                  f"Active Alarms={status['active_alarms']}/{status['total_monitored']}, "
+                  f"Overruns={status['overruns']}, Skipped={status['skipped_cycles']}")
+            for cycle in status['scan_cycles']:
+                print(f"  {cycle['device']}/{cycle['scan_class']}: "
+                      f"period={cycle['period_ms']}ms, cycles={cycle['cycles']}, "
+                      f"duration avg/max={cycle['avg_duration_ms']}/{cycle['max_duration_ms']}ms, "
+                      f"jitter avg/max={cycle['avg_jitter_ms']}/{cycle['max_jitter_ms']}ms")
+            if len(status['devices']) > 1:
+                for device in status['devices']:
+                    retry = (f" (retry in {device['reconnect_in']}s)"
+                             if device['connection_state'] == STATE_DISCONNECTED else "")
+                    print(f"  {device['name']} ({device['host']}:{device['port']}): "
+                          f"State={device['connection_state']}{retry}, "
+                          f"Active Alarms={device['active_alarms']}/{device['total_monitored']}")
             
     except KeyboardInterrupt:
         print("\n\nShutting down...")
@@ -0,0 +1,182 @@
+"""
+Modbus outstation (device) definitions for fleet polling.
+"""
+
+import logging
+import random
+import threading
+import time
+from scan_planner import DEFAULT_MAX_GAP, compile_alarm_points
+from scan_scheduler import build_scan_classes
+
+# Connection states of a device
+STATE_DISCONNECTED = 'disconnected'
+STATE_CONNECTING = 'connecting'
+STATE_CONNECTED = 'connected'
+
+
+class ReconnectBackoff:
+    """Exponential backoff with jitter between reconnect attempts
+
+    After the n-th consecutive failure the next attempt waits between half
+    and all of delay_min * 2^(n-1), capped at delay_max and never below
+    delay_min. The jitter keeps a fleet of devices from retrying in lockstep.
+    """
+
+    def __init__(self, delay_min=0.1, delay_max=300, clock=time.monotonic):
+        """Initialize backoff
+
+        Args:
+            delay_min: Shortest wait before a retry (modbus.reconnect_delay)
+            delay_max: Longest wait before a retry (modbus.reconnect_delay_max)
+            clock: Monotonic clock function returning seconds
+        """
+        self.delay_min = delay_min
+        self.delay_max = max(delay_min, delay_max)
+        self.clock = clock
+        self.attempts = 0
+        self.next_attempt = 0.0
+
+    def failure(self):
+        """Record a failed attempt and schedule the next one
+
+        Returns:
+            float: Seconds until the next attempt
+        """
+        self.attempts += 1
+        ceiling = min(self.delay_max, self.delay_min * 2 ** (self.attempts - 1))
+        delay = max(self.delay_min, random.uniform(ceiling / 2, ceiling))
+        self.next_attempt = self.clock() + delay
+        return delay
+
+    def success(self):
+        """Reset after a successful connection"""
+        self.attempts = 0
+        self.next_attempt = 0.0
+
+    def ready(self):
+        """Check if the next attempt is due"""
+        return self.clock() >= self.next_attempt
+
+    def time_to_retry(self):
+        """Seconds until the next attempt is due"""
+        return max(0.0, self.next_attempt - self.clock())
+
+
+class ModbusDevice:
+    """Connection settings, scan plan and alarm state of one Modbus outstation"""
+
+    def __init__(self, name, host, port, unit_id=1, machine_name=None, mappings=None,
+                 max_gap=DEFAULT_MAX_GAP, class_periods=None, default_period=1.0,
+                 reconnect_delay=0.1, reconnect_delay_max=300):
+        """Initialize device
+
+        Args:
+            name: Device name used in logs and status
+            host: Modbus TCP host
+            port: Modbus TCP port
+            unit_id: Modbus unit (device) id
+            machine_name: Machine name written to alarm_history (default: name)
+            mappings: Alarm mappings scanned on this device
+            max_gap: Maximum address gap bridged by a block read
+            class_periods: Dictionary of priority -> scan period in seconds
+            default_period: Scan period of points without a scan class
+            reconnect_delay: Shortest wait between reconnect attempts
+            reconnect_delay_max: Longest wait between reconnect attempts
+        """
+        self.name = name
+        self.host = host
+        self.port = port
+        self.unit_id = unit_id
+        self.machine_name = machine_name or name
+        self.points = compile_alarm_points(mappings or [])
+        self.scan_classes = build_scan_classes(
+            self.points, class_periods, default_period, max_gap=max_gap
+        )
+        self.scan_windows = [window for scan_class in self.scan_classes for window in scan_class.windows]
+        self.alarm_states = bytearray(len(self.points))  # Previous state per point index
+
+        self.client = None  # ModbusTcpClient (thread engine)
+        self.clients = []  # AsyncModbusTcpClient connections (async engine)
+        self.scan_lock = threading.Lock()  # Serializes scan classes on the shared client
+        self.connection_state = STATE_DISCONNECTED
+        self.backoff = ReconnectBackoff(reconnect_delay, reconnect_delay_max)
+        self.connect_task = None  # Reconnect task in progress (async engine)
+
+    def active_alarm_count(self):
+        """Number of alarms currently active on this device"""
+        return sum(self.alarm_states)
+
+    def __repr__(self):
+        return f"ModbusDevice({self.name} {self.host}:{self.port} unit={self.unit_id})"
+
+
+def load_devices(config, alarm_mapping):
+    """Build the list of devices to poll from configuration
+
+    modbus.devices is a list of device definitions:
+        - name: Device name (required)
+        - host, port: Modbus TCP address (required)
+        - unit_id: Modbus unit id (default: 1)
+        - machine_name: Machine name written to alarm_history (default: name)
+        - items: alarm_mapping items scanned on this device (default: all)
+        - enabled: Set to false to skip the device (default: true)
+
+    Without modbus.devices a single device is created from modbus.mode /
+    modbus.hosts and monitoring.machine_name.
+
+    Args:
+        config: Application configuration dictionary
+        alarm_mapping: List of mapping dictionaries from load_alarm_mapping()
+
+    Returns:
+        list: ModbusDevice objects
+    """
+    modbus_config = config['modbus']
+    options = {
+        'max_gap': modbus_config.get('max_read_gap', DEFAULT_MAX_GAP),
+        'class_periods': config['monitoring'].get('scan_classes', {}),
+        'default_period': config['monitoring']['scan_interval'],
+        'reconnect_delay': modbus_config.get('reconnect_delay', 0.1),
+        'reconnect_delay_max': modbus_config.get('reconnect_delay_max', 300)
+    }
+
+    if not modbus_config.get('devices'):
+        mode = modbus_config.get('mode', 'real')
+        host_config = modbus_config['hosts'][mode]
+        return [ModbusDevice(
+            name=mode.upper(),
+            host=host_config['host'],
+            port=host_config['port'],
+            unit_id=host_config.get('unit_id', 1),
+            machine_name=config['monitoring']['machine_name'],
+            mappings=alarm_mapping,
+            **options
+        )]
+
+    devices = []
+    for device_config in modbus_config['devices']:
+        if not device_config.get('enabled', True):
+            continue
+
+        items = device_config.get('items')
+        if items is None:
+            mappings = list(alarm_mapping)
+        else:
+            items = set(items)
+            mappings = [mapping for mapping in alarm_mapping if mapping['item'] in items]
+
+        if not mappings:
+            logging.warning(f"Device {device_config['name']} has no alarm mappings")
+
+        devices.append(ModbusDevice(
+            name=device_config['name'],
+            host=device_config['host'],
+            port=device_config['port'],
+            unit_id=device_config.get('unit_id', 1),
+            machine_name=device_config.get('machine_name'),
+            mappings=mappings,
+            **options
+        ))
+
+    return devices
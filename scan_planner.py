@@ -0,0 +1,180 @@
+"""
+Scan planning utilities for grouping alarm mappings into Modbus block reads.
+"""
+
+import logging
+import sys
+from enum import IntEnum
+
+# Modbus protocol limit for a single Read Coils / Read Discrete Inputs request
+MAX_READ_BITS = 2000
+
+# Default number of unused addresses bridged between two mapped points
+DEFAULT_MAX_GAP = 16
+
+
+
+class FunctionCode(IntEnum):
+    """Modbus function codes supported by the scan"""
+    READ_COILS = 1
+    READ_DISCRETE_INPUTS = 2
+
+
+FUNCTION_READ_COILS = FunctionCode.READ_COILS
+FUNCTION_READ_DISCRETE_INPUTS = FunctionCode.READ_DISCRETE_INPUTS
+
+
+def parse_function_code(modbus_function):
+    """Resolve the free-text modbus_function column to a function code
+
+    Args:
+        modbus_function: Text such as '01: READ OUTPUT STATUS'
+
+    Returns:
+        FunctionCode: READ_COILS, READ_DISCRETE_INPUTS or None if unsupported
+    """
+    if not modbus_function:
+        return None
+    if '01' in modbus_function:
+        return FUNCTION_READ_COILS
+    if '02' in modbus_function:
+        return FUNCTION_READ_DISCRETE_INPUTS
+    return None
+
+
+def _intern(text):
+    """Intern a mapping string so every point shares one copy"""
+    return sys.intern(text) if isinstance(text, str) else text
+
+
+class AlarmPoint:
+    """One alarm_mapping row compiled for the scan loop
+
+    Everything the scan needs is resolved once: the function code enum, the
+    integer address and bit, and interned description and status strings.
+    index is the position of the point in the alarm state array of its device.
+    """
+
+    __slots__ = ('item', 'description', 'priority', 'function_code', 'address',
+                 'bit_no', 'close_status', 'alarm_status', 'index')
+
+    def __init__(self, item, description, priority, function_code, address,
+                 bit_no=0, close_status='', alarm_status='', index=0):
+        self.item = item
+        self.description = _intern(description)
+        self.priority = _intern(priority)
+        self.function_code = function_code
+        self.address = address
+        self.bit_no = bit_no
+        self.close_status = _intern(close_status)
+        self.alarm_status = _intern(alarm_status)
+        self.index = index
+
+    def __repr__(self):
+        return f"AlarmPoint({self.item}, fc={self.function_code.value:02d}, address={self.address})"
+
+
+def compile_alarm_points(mappings):
+    """Compile alarm mappings into AlarmPoint objects
+
+    Args:
+        mappings: List of mapping dictionaries from load_alarm_mapping()
+
+    Returns:
+        list: AlarmPoint objects indexed 0..n-1; unsupported functions are skipped
+    """
+    points = []
+    for mapping in mappings:
+        function_code = parse_function_code(mapping['modbus_function'])
+        if function_code is None:
+            logging.warning(f"Unsupported Modbus function for {mapping['description']}")
+            continue
+        points.append(AlarmPoint(
+            item=mapping['item'],
+            description=mapping['description'],
+            priority=mapping.get('priority'),
+            function_code=function_code,
+            address=int(mapping['address']),
+            bit_no=int(mapping.get('bit_no') or 0),
+            close_status=mapping.get('close_status') or '',
+            alarm_status=mapping.get('alarm_status') or '',
+            index=len(points)
+        ))
+    return points
+
+
+class ScanWindow:
+    """A contiguous address range read with a single Modbus request"""
+
+    def __init__(self, function_code, start, count=1):
+        """Initialize scan window
+
+        Args:
+            function_code: FunctionCode of the window
+            start: First address of the window
+            count: Number of bits read from start
+        """
+        self.function_code = function_code
+        self.start = start
+        self.count = count
+        self.points = []  # (offset, point) pairs
+        self.points_by_offset = {}  # offset -> points at that address
+
+        # Bit images hold one byte per address (bytes(bits)), so the bit of
+        # the point at offset n is bit 8 * n of the integer.
+        self.mask = 0  # Bits of the mapped addresses
+        self.image = 0  # Image of the previous successful read
+
+    def add(self, point):
+        """Add a point to the window, growing it to cover the point address"""
+        offset = point.address - self.start
+        self.count = max(self.count, offset + 1)
+        self.points.append((offset, point))
+        self.points_by_offset.setdefault(offset, []).append(point)
+        self.mask |= 1 << (offset * 8)
+
+    def __repr__(self):
+        return (f"ScanWindow(fc={self.function_code.value:02d}, start={self.start}, "
+                f"count={self.count}, points={len(self.points)})")
+
+
+def pack_bits(bits):
+    """Pack a list of read bits into an integer bit image (one byte per bit)"""
+    return int.from_bytes(bytes(bits), 'little')
+
+
+def plan_scan_windows(points, max_gap=DEFAULT_MAX_GAP, max_bits=MAX_READ_BITS):
+    """Group alarm points into block-read windows
+
+    Points are grouped by function code and sorted by address. Consecutive
+    addresses are merged into one window as long as the hole between them is
+    at most max_gap addresses and the window stays within max_bits.
+
+    Args:
+        points: AlarmPoint objects from compile_alarm_points()
+        max_gap: Maximum number of unmapped addresses bridged inside a window
+        max_bits: Maximum number of bits read by a single request
+
+    Returns:
+        list: ScanWindow objects ordered by function code and start address
+    """
+    by_function = {}
+    for point in points:
+        by_function.setdefault(point.function_code, []).append(point)
+
+    windows = []
+    for function_code in sorted(by_function):
+        window = None
+        for point in sorted(by_function[function_code], key=lambda p: p.address):
+            address = point.address
+            if window is not None:
+                gap = address - (window.start + window.count)
+                if gap <= max_gap and address - window.start < max_bits:
+                    window.add(point)
+                    continue
+
+            window = ScanWindow(function_code, address)
+            window.add(point)
+            windows.append(window)
+
+    return windows
@@ -0,0 +1,221 @@
+"""
+Priority-tiered scan scheduling: scan classes and a deadline-ordered timer queue.
+"""
+
+import heapq
+import itertools
+import time
+from scan_planner import plan_scan_windows, DEFAULT_MAX_GAP
+
+DEFAULT_SCAN_CLASS = 'DEFAULT'
+
+# What to do with cycles whose deadline passed while the scheduler was late
+OVERRUN_SKIP = 'skip'  # drop missed cycles and stay on the original deadline grid
+OVERRUN_COMPRESS = 'compress'  # run the late cycle immediately and re-anchor the grid
+
+
+class ScanClass:
+    """A group of alarm points polled at the same period"""
+
+    def __init__(self, name, period, windows):
+        """Initialize scan class
+
+        Args:
+            name: Class name (alarm_mapping.priority or DEFAULT_SCAN_CLASS)
+            period: Scan period in seconds
+            windows: ScanWindow objects read on every scan of this class
+        """
+        self.name = name
+        self.period = period
+        self.windows = windows
+
+    def __repr__(self):
+        return f"ScanClass({self.name}, period={self.period}s, windows={len(self.windows)})"
+
+
+def build_scan_classes(points, class_periods, default_period, max_gap=DEFAULT_MAX_GAP):
+    """Split alarm points into scan classes by their priority
+
+    Args:
+        points: AlarmPoint objects from compile_alarm_points()
+        class_periods: Dictionary of priority -> scan period in seconds
+            (monitoring.scan_classes), matched case-insensitively
+        default_period: Period for priorities without a scan class
+            (monitoring.scan_interval)
+        max_gap: Maximum address gap bridged by a block read
+
+    Returns:
+        list: ScanClass objects ordered by period
+    """
+    periods = {name.upper(): float(period) for name, period in (class_periods or {}).items()}
+
+    grouped = {}
+    for point in points:
+        priority = (point.priority or '').upper()
+        name = priority if priority in periods else DEFAULT_SCAN_CLASS
+        grouped.setdefault(name, []).append(point)
+
+    scan_classes = [
+        ScanClass(name, periods.get(name, default_period), plan_scan_windows(members, max_gap=max_gap))
+        for name, members in grouped.items()
+    ]
+    scan_classes.sort(key=lambda scan_class: scan_class.period)
+    return scan_classes
+
+
+class CycleStats:
+    """Timing statistics of a periodic scan job
+
+    Jitter is the lateness of a scan start against its scheduled deadline,
+    duration the time the scan took. A scan longer than its period counts as
+    an overrun; a cycle that was not run at all counts as skipped.
+    """
+
+    def __init__(self, period):
+        """Initialize statistics
+
+        Args:
+            period: Scan period in seconds
+        """
+        self.period = period
+        self.cycles = 0
+        self.overruns = 0
+        self.skipped = 0
+        self.last_duration = 0.0
+        self.max_duration = 0.0
+        self.total_duration = 0.0
+        self.last_jitter = 0.0
+        self.max_jitter = 0.0
+        self.total_jitter = 0.0
+
+    def record(self, deadline, started, finished):
+        """Record one completed scan
+
+        Args:
+            deadline: Scheduled start on the monotonic clock
+            started: Actual start on the monotonic clock
+            finished: End of the scan on the monotonic clock
+        """
+        duration = finished - started
+        jitter = max(0.0, started - deadline)
+
+        self.cycles += 1
+        self.last_duration = duration
+        self.max_duration = max(self.max_duration, duration)
+        self.total_duration += duration
+        self.last_jitter = jitter
+        self.max_jitter = max(self.max_jitter, jitter)
+        self.total_jitter += jitter
+
+        if duration > self.period:
+            self.overruns += 1
+
+    def as_dict(self):
+        """Statistics as a dictionary (times in milliseconds)"""
+        cycles = self.cycles or 1
+        return {
+            'period_ms': round(self.period * 1000, 1),
+            'cycles': self.cycles,
+            'overruns': self.overruns,
+            'skipped': self.skipped,
+            'last_duration_ms': round(self.last_duration * 1000, 1),
+            'avg_duration_ms': round(self.total_duration / cycles * 1000, 1),
+            'max_duration_ms': round(self.max_duration * 1000, 1),
+            'last_jitter_ms': round(self.last_jitter * 1000, 1),
+            'avg_jitter_ms': round(self.total_jitter / cycles * 1000, 1),
+            'max_jitter_ms': round(self.max_jitter * 1000, 1)
+        }
+
+
+class ScanJob:
+    """Periodic scan of one scan class on one device"""
+
+    def __init__(self, device, scan_class):
+        """Initialize scan job
+
+        Args:
+            device: ModbusDevice scanned by the job
+            scan_class: ScanClass read by the job
+        """
+        self.device = device
+        self.scan_class = scan_class
+        self.pending = None  # Future/Task of the scan in progress
+        self.stats = CycleStats(scan_class.period)
+
+    def is_pending(self):
+        """Check if the previous scan of this job is still running"""
+        return self.pending is not None and not self.pending.done()
+
+    def __repr__(self):
+        return f"ScanJob({self.device.name}, {self.scan_class.name})"
+
+
+class ScanScheduler:
+    """Deadline-ordered timer queue of periodic scan jobs
+
+    All jobs share one heap ordered by their next deadline on the monotonic
+    clock, so every scan class is polled at its own period from a single
+    timer loop. Deadlines advance by whole periods from the first one, so the
+    cycle never drifts with scan time or network latency.
+    """
+
+    def __init__(self, clock=time.monotonic, overrun_policy=OVERRUN_SKIP):
+        """Initialize scheduler
+
+        Args:
+            clock: Monotonic clock function returning seconds
+            overrun_policy: OVERRUN_SKIP or OVERRUN_COMPRESS
+        """
+        self.clock = clock
+        self.overrun_policy = overrun_policy
+        self._queue = []  # (deadline, sequence, job)
+        self._sequence = itertools.count()
+
+    def add(self, job, first_due=None):
+        """Schedule a job, due immediately unless first_due is given"""
+        deadline = self.clock() if first_due is None else first_due
+        heapq.heappush(self._queue, (deadline, next(self._sequence), job))
+
+    def __len__(self):
+        return len(self._queue)
+
+    def time_until_next(self, idle=1.0):
+        """Seconds until the earliest deadline (<= 0 when a job is due)
+
+        Args:
+            idle: Value returned when no job is scheduled
+        """
+        if not self._queue:
+            return idle
+        return self._queue[0][0] - self.clock()
+
+    def pop_due(self):
+        """Return all due jobs and reschedule each at its next period
+
+        When the scheduler fell more than a period behind, missed cycles are
+        dropped (OVERRUN_SKIP) or the grid is re-anchored on the late run,
+        one period from now (OVERRUN_COMPRESS).
+
+        Returns:
+            list: (ScanJob, deadline) pairs whose deadline has passed
+        """
+        now = self.clock()
+        due = []
+        while self._queue and self._queue[0][0] <= now:
+            deadline, _, job = heapq.heappop(self._queue)
+            due.append((job, deadline))
+
+        for job, deadline in due:
+            period = job.scan_class.period
+            next_deadline = deadline + period
+            if next_deadline <= now:
+                # Whole periods missed since the late deadline
+                missed = int((now - deadline) // period)
+                job.stats.skipped += missed
+                if self.overrun_policy == OVERRUN_COMPRESS:
+                    # The late cycle is the one being run now
+                    next_deadline = now + period
+                else:
+                    next_deadline = deadline + (missed + 1) * period
+            heapq.heappush(self._queue, (next_deadline, next(self._sequence), job))
+        return due